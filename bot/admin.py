@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Deck, Card, Question, Answer, User, LearningMatrix, ShownQuestion
+from .models import Deck, Card, Question, Answer, User, LearningMatrix, StateItem, UserStats, \
+    UserDeck, ConversationReferenceItem, ReviewEvent
 
 
 class CardAdmin(admin.ModelAdmin):
@@ -17,4 +18,8 @@ admin.site.register(Question)
 admin.site.register(Answer,AnswerAdmin)
 admin.site.register(User)
 admin.site.register(LearningMatrix)
-admin.site.register(ShownQuestion)
+admin.site.register(StateItem)
+admin.site.register(UserStats)
+admin.site.register(UserDeck)
+admin.site.register(ConversationReferenceItem)
+admin.site.register(ReviewEvent)
@@ -0,0 +1,84 @@
+import os
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+from bot.models import Answer, Question
+
+# Typed answers up to this many edits (insertions, deletions, substitutions) away from a correct one
+# still count as correct. Answers shorter than TYPO_MIN_LENGTH must match exactly.
+TYPO_TOLERANCE = int(os.getenv("ANSWER_TYPO_TOLERANCE", "0"))
+TYPO_MIN_LENGTH = 5
+
+
+def normalize(text: str) -> str:
+    """
+    Folds the differences users do not mean: Unicode compatibility forms, case and runs of whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class AnswerIndex:
+    """
+    Normalized answers of one question, built once from its prefetched answers.
+    """
+
+    def __init__(self, question: Question, typo_tolerance: int = None):
+        answers = list(question.answers.all())
+        self.typo_tolerance = TYPO_TOLERANCE if typo_tolerance is None else typo_tolerance
+        self.correct: Set[str] = {normalize(answer.text) for answer in answers if answer.correct}
+        self.all: Set[str] = {normalize(answer.text) for answer in answers}
+        # the answer to reveal: the only one, or the first correct one
+        self.correct_answer: Optional[Answer] = answers[0] if len(answers) == 1 else \
+            next((answer for answer in answers if answer.correct), None)
+        self._correct_by_length: Dict[int, Set[str]] = defaultdict(set)
+        for text in self.correct:
+            self._correct_by_length[len(text)].add(text)
+
+    def is_correct(self, user_answer: str) -> bool:
+        text = normalize(user_answer or "")
+        if text in self.correct:
+            return True
+        if self.typo_tolerance <= 0 or len(text) < TYPO_MIN_LENGTH:
+            return False
+        # only answers whose length is within the tolerance can be close enough
+        for length in range(len(text) - self.typo_tolerance, len(text) + self.typo_tolerance + 1):
+            for candidate in self._correct_by_length.get(length, ()):
+                if within_distance(text, candidate, self.typo_tolerance):
+                    return True
+        return False
+
+    def has_answer(self, text: str) -> bool:
+        return normalize(text) in self.all
+
+
+def answer_index(question: Question) -> AnswerIndex:
+    """
+    The question's index, built on first use and kept on the instance, which bot.content caches.
+    """
+    index = getattr(question, "_answer_index", None)
+    if index is None:
+        index = question._answer_index = AnswerIndex(question)
+    return index
+
+
+def within_distance(a: str, b: str, limit: int) -> bool:
+    """
+    Whether the Levenshtein distance of a and b is at most limit. Only the band of cells that can stay
+    within the limit is computed and the scan stops as soon as a whole row exceeds it.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    too_far = limit + 1
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost, too_far)
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[len(b)] <= limit
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BotConfig(AppConfig):
     name = 'bot'
+
+    def ready(self):
+        # connects the stats' signal handlers in every process, not only those that load the dialogs
+        from bot import stats  # noqa: F401
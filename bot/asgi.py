@@ -0,0 +1,142 @@
+import json
+from http import HTTPStatus
+from logging import getLogger
+
+from botbuilder.core import BotFrameworkAdapter
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+from botframework.connector.auth import ClaimsIdentity, JwtTokenValidation
+from msrest.exceptions import DeserializationError
+
+from bot.activity_handler import DialogBot
+from bot.dispatcher import ConversationDispatcher
+from bot.turn_pool import TurnWorkerPool
+
+logger = getLogger(__name__)
+
+
+class BotMessagesApp:
+    """
+    Native ASGI endpoint for bot messages. Unlike the Django view it does not wrap the adapter in
+    async_to_sync, so every turn runs on the server's event loop and only the ORM helpers hop to a thread.
+    Turns of one conversation are serialized by the dispatcher; in ACK_MODE the pool does that.
+    """
+
+    def __init__(self, adapter: BotFrameworkAdapter, bot: DialogBot, pool: TurnWorkerPool = None,
+                 dispatcher: ConversationDispatcher = None):
+        self.adapter = adapter
+        self.bot = bot
+        # when a pool is given, requests are acknowledged before the turn runs
+        self.pool = pool
+        self.dispatcher = dispatcher or ConversationDispatcher()
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] != "POST":
+            return await send_response(send, HTTPStatus.METHOD_NOT_ALLOWED)
+
+        headers = dict(scope["headers"])
+        if b"application/json" not in headers.get(b"content-type", b""):
+            return await send_response(send, HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+
+        body = await read_body(receive)
+        try:
+            activity = Activity().deserialize(json.loads(body))
+        except (ValueError, KeyError, TypeError, DeserializationError):
+            return await send_response(send, HTTPStatus.BAD_REQUEST)
+        auth_header = headers.get(b"authorization", b"").decode()
+
+        if self.pool is not None and can_acknowledge(activity):
+            return await self.acknowledge(activity, auth_header, send)
+
+        try:
+            response = await self.dispatcher.run(
+                conversation_id(activity),
+                lambda: self.adapter.process_activity(activity, auth_header, self.bot.on_turn))
+        except PermissionError:
+            return await send_response(send, HTTPStatus.UNAUTHORIZED)
+        if response:
+            return await send_response(send, response.status, response.body)
+        return await send_response(send, HTTPStatus.OK)
+
+    async def acknowledge(self, activity: Activity, auth_header: str, send):
+        try:
+            identity = await self.authenticate(activity, auth_header)
+        except PermissionError:
+            return await send_response(send, HTTPStatus.UNAUTHORIZED)
+
+        accepted = self.pool.submit(
+            lambda: self.adapter.process_activity_with_identity(activity, identity, self.bot.on_turn),
+            conversation_id(activity))
+        if not accepted:
+            return await send_response(send, HTTPStatus.SERVICE_UNAVAILABLE)
+        return await send_response(send, HTTPStatus.ACCEPTED)
+
+    async def authenticate(self, activity: Activity, auth_header: str) -> ClaimsIdentity:
+        # the same check process_activity makes, done up front so the turn can be acknowledged
+        settings = self.adapter.settings
+        identity = await JwtTokenValidation.authenticate_request(
+            activity, auth_header, settings.credential_provider, settings.channel_provider,
+            settings.auth_configuration)
+        if not identity.is_authenticated:
+            raise PermissionError("Unauthorized Access. Request is not authorized")
+        return identity
+
+
+def conversation_id(activity: Activity) -> str:
+    return activity.conversation.id if activity.conversation else None
+
+
+def can_acknowledge(activity: Activity) -> bool:
+    # invoke activities and expectReplies deliveries carry the bot's answer in the HTTP response
+    return activity.type != ActivityTypes.invoke and activity.delivery_mode != DeliveryModes.expect_replies
+
+
+class BotRouter:
+    """
+    Top level ASGI application. Bot routes are served natively, everything else (admin, static files,
+    /api/notify) falls through to Django.
+    """
+
+    def __init__(self, django_application, routes, on_shutdown=()):
+        self.django_application = django_application
+        self.routes = routes
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["path"] in self.routes:
+            return await self.routes[scope["path"]](scope, receive, send)
+        return await self.django_application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        # Django 3.0 rejects lifespan scopes, so acknowledge them here.
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for callback in self.on_shutdown:
+                    await callback()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_response(send, status, body=None):
+    headers = []
+    content = b""
+    if body is not None:
+        content = json.dumps(body).encode()
+        headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(content)).encode()))
+    await send({"type": "http.response.start", "status": int(status), "headers": headers})
+    await send({"type": "http.response.body", "body": content})
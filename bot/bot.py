@@ -1,30 +1,30 @@
 import os
 import sys
+import tempfile
 import traceback
 from datetime import datetime
-from typing import Dict
-from http import HTTPStatus
 
-from botbuilder.core.integration import aiohttp_error_middleware
-from botbuilder.schema import Activity, ActivityTypes, ConversationReference
+from botbuilder.schema import Activity, ActivityTypes
 
 from bot.activity_handler import DialogBot
 from bot.dialog.main_dialog import MainDialog
 from dotenv import load_dotenv
-from aiohttp import web
-from aiohttp.web import Request, Response, json_response
 
+from bot.dispatcher import ConversationDispatcher
+from bot.metrics import METRICS, MeteredAdapter, measure_queries
+from bot.profiling import TurnProfiler
+from bot.references import ConversationReferenceStore
+from bot.reminders import ReminderScheduler
 from bot.state import CONVERSATION_STATE, USER_STATE
+from bot.storage import ETagConflict
+from bot.turn_pool import TurnWorkerPool
+from bot.users import UserActivity
 
 load_dotenv(verbose=True)
 
 from botbuilder.core import (
-    BotFrameworkAdapter,
     BotFrameworkAdapterSettings,
-    ConversationState,
-    MemoryStorage,
     TurnContext,
-    UserState,
 )
 
 
@@ -34,6 +34,25 @@ class DefaultConfig:
     PORT = 3978
     APP_ID = os.getenv("APP_ID")
     APP_PASSWORD = os.getenv("APP_PASSWORD")
+    # Acknowledge webhook requests with 202 and run the turn on the background worker pool.
+    ACK_MODE = os.getenv("ACK_MODE", "false").lower() == "true"
+    TURN_WORKERS = int(os.getenv("TURN_WORKERS", "16"))
+    TURN_QUEUE_SIZE = int(os.getenv("TURN_QUEUE_SIZE", "1000"))
+    # How often buffered User.last_interaction_time values are written to the database.
+    USER_FLUSH_SECONDS = float(os.getenv("USER_FLUSH_SECONDS", "60"))
+    # Due-card reminders sent by /api/notify: messages in flight, messages per second per channel
+    # and users read from the learning matrix per query.
+    REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "10"))
+    REMINDER_RATE = float(os.getenv("REMINDER_RATE", "25"))
+    REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+    # Conversation references kept in memory in front of the database.
+    CONVERSATION_REFERENCE_CACHE_SIZE = int(os.getenv("CONVERSATION_REFERENCE_CACHE_SIZE", "10000"))
+    # Per-turn wall time, database queries, state round trips and sends, served at /api/metrics.
+    TURN_METRICS = os.getenv("TURN_METRICS", "true").lower() == "true"
+    # Profile one in PROFILE_SAMPLE_RATE turns (0 is off), keeping the newest PROFILE_KEEP in PROFILE_DIR.
+    PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "sashick-profiles"))
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
 
 
 CONFIG = DefaultConfig()
@@ -41,7 +60,9 @@ CONFIG = DefaultConfig()
 # Create adapter.
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
 SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
-ADAPTER = BotFrameworkAdapter(SETTINGS)
+ADAPTER = MeteredAdapter(SETTINGS, METRICS if CONFIG.TURN_METRICS else None)
+if CONFIG.TURN_METRICS:
+    measure_queries()
 
 
 # Catch-all for errors.
@@ -52,6 +73,11 @@ async def on_error(context: TurnContext, error: Exception):
     print(f"\n [on_turn_error]: {error}", file=sys.stderr)
     traceback.print_exc()
 
+    if isinstance(error, ETagConflict):
+        # another turn of the conversation saved its state first, which stays valid: the user only has to resend
+        await context.send_activity("Sorry, your last message crossed another one. Please send it again.")
+        return
+
     # Send a message to the user
     await context.send_activity("The bot encountered an error or bug.")
     await context.send_activity("To continue to run this bot, please fix the bot source code.")
@@ -78,13 +104,20 @@ async def on_error(context: TurnContext, error: Exception):
 # In this case, we want an unbound method, so MethodType is not needed.
 ADAPTER.on_turn_error = on_error
 
-# Create a shared dictionary.  The Bot will add conversation references when users
-# join the conversation and send messages.
-CONVERSATION_REFERENCES: Dict[str, ConversationReference] = dict()
+# The Bot adds conversation references when users join the conversation and send messages.
+CONVERSATION_REFERENCES = ConversationReferenceStore(CONFIG.CONVERSATION_REFERENCE_CACHE_SIZE)
 
 # create main dialog and bot
 DIALOG = MainDialog(CONVERSATION_STATE, USER_STATE)
 APP_ID = os.getenv("APP_ID")
-BOT = DialogBot(CONVERSATION_STATE, USER_STATE, DIALOG, CONVERSATION_REFERENCES)
-
-
+USER_ACTIVITY = UserActivity(CONFIG.USER_FLUSH_SECONDS)
+PROFILER = TurnProfiler(CONFIG.PROFILE_SAMPLE_RATE, CONFIG.PROFILE_DIR, CONFIG.PROFILE_KEEP)
+BOT = DialogBot(CONVERSATION_STATE, USER_STATE, DIALOG, CONVERSATION_REFERENCES, USER_ACTIVITY, PROFILER)
+
+# Keeps turns of one conversation in order, shared by the inline and ACK_MODE paths.
+DISPATCHER = ConversationDispatcher()
+# Background workers for turns accepted in ACK_MODE.
+TURN_POOL = TurnWorkerPool(CONFIG.TURN_WORKERS, CONFIG.TURN_QUEUE_SIZE, DISPATCHER)
+# Due-card reminders for users the bot has a conversation reference of.
+REMINDERS = ReminderScheduler(ADAPTER, CONVERSATION_REFERENCES, CONFIG.APP_ID, CONFIG.REMINDER_CONCURRENCY,
+                              CONFIG.REMINDER_BATCH_SIZE, CONFIG.REMINDER_RATE)
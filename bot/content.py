@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List
+
+from botbuilder.core import TurnContext
+from django.db.models.signals import post_delete, post_save
+
+from bot.db import db_call
+from bot.models import Answer, Card, Deck, Question
+
+# Dialog state only keeps primary keys of cards and questions; these helpers turn them back into model
+# instances. Decks, cards, questions and answers only change in the admin, so instances are kept in a
+# process-wide cache and, on top of that, in the turn state, so a turn never looks at one twice.
+TURN_CACHE_KEY = "ContentCache"
+
+RELATED = {
+    Card: ("deck",),
+    Question: (),
+}
+PREFETCHED = {
+    Card: (),
+    Question: ("answers",),
+}
+
+
+class ContentCache:
+    """
+    Size-bounded LRU cache of content loaded from the database. Every save or delete of a content model
+    bumps the version, which makes all cached entries stale, so the admin never shows outdated content to
+    the users of this process. Other server processes pick the change up after `max_age` seconds at most.
+    Bulk queryset updates and bulk_create do not send signals; call invalidate() after them.
+    """
+
+    def __init__(self, max_size: int = 10000, max_age: float = 300):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # key -> (version, loaded at, value), in least recently used order
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load: Callable):
+        """
+        Returns the cached value for the key, calling load() (which may query the database) on a miss.
+        """
+        found, value, version = self.lookup(key)
+        if not found:
+            value = load()
+            self.store(key, value, version)
+        return value
+
+    def lookup(self, key):
+        """
+        Returns (found, value, version). On a miss, pass the version to store() once the value is loaded.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self.version and time.monotonic() - entry[1] < self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2], self.version
+            self.misses += 1
+            return False, None, self.version
+
+    def store(self, key, value, version: int):
+        with self._lock:
+            # content that changed while it was loading is not cached
+            if version != self.version:
+                return
+            self._entries[key] = (version, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Drops everything, connected to the content models' post_save and post_delete signals.
+        """
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'version': self.version,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+CONTENT = ContentCache(int(os.getenv("CONTENT_CACHE_SIZE", "10000")),
+                       float(os.getenv("CONTENT_CACHE_SECONDS", "300")))
+
+for content_model in (Deck, Card, Question, Answer):
+    post_save.connect(CONTENT.invalidate, sender=content_model, dispatch_uid=f"content-cache-save-{content_model.__name__}")
+    post_delete.connect(CONTENT.invalidate, sender=content_model, dispatch_uid=f"content-cache-delete-{content_model.__name__}")
+
+
+async def get_card(turn_context: TurnContext, card_id: int) -> Card:
+    return await _get(turn_context, Card, card_id)
+
+
+async def get_question(turn_context: TurnContext, question_id: int) -> Question:
+    return await _get(turn_context, Question, question_id)
+
+
+def remember(turn_context: TurnContext, instance):
+    """
+    Adds an instance that was loaded anyway to the turn cache.
+    """
+    _turn_cache(turn_context)[(type(instance), instance.pk)] = instance
+
+
+def card(card_id: int) -> Card:
+    """
+    Cached card with its deck, for code that already runs in a database thread.
+    """
+    return CONTENT.get((Card, card_id), lambda: _query(Card, card_id))
+
+
+def decks() -> List[Deck]:
+    """
+    Every deck, in id order.
+    """
+    return CONTENT.get(Deck, lambda: list(Deck.objects.order_by('id')))
+
+
+def cards_count(deck_id: int) -> int:
+    return CONTENT.get(("cards_count", deck_id), lambda: Card.objects.filter(deck=deck_id).count())
+
+
+async def _get(turn_context: TurnContext, model, pk):
+    if pk is None:
+        return None
+    cache = _turn_cache(turn_context)
+    if (model, pk) not in cache:
+        # only a miss takes the hop to a database thread
+        found, instance, version = CONTENT.lookup((model, pk))
+        if not found:
+            instance = await _load(model, pk)
+            CONTENT.store((model, pk), instance, version)
+        cache[(model, pk)] = instance
+    return cache[(model, pk)]
+
+
+def _query(model, pk):
+    return model.objects.select_related(*RELATED[model]).prefetch_related(*PREFETCHED[model]).get(pk=pk)
+
+
+_load = db_call(_query)
+
+
+def _turn_cache(turn_context: TurnContext) -> dict:
+    return turn_context.turn_state.setdefault(TURN_CACHE_KEY, {})
@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connections
+
+from bot.metrics import db_call_measured
+
+
+class DatabaseExecutor:
+    """
+    Runs blocking ORM code for the dialogs on a bounded pool of threads, so queries of different users
+    overlap instead of queueing for asgiref's single thread-sensitive thread. Django keeps one connection
+    per thread, so each worker reuses its own connection across calls. Before every call the worker closes
+    its connection if it is older than CONN_MAX_AGE or unusable after an error, as Django does between
+    requests, and the call opens a new one. With `thread_sensitive` set the calls go through sync_to_async
+    as before, which tests need because their data lives in the main thread's transaction.
+    """
+
+    def __init__(self, workers: int, thread_sensitive: bool = False):
+        if workers < 1 and not thread_sensitive:
+            raise ValueError(f"a database executor needs at least one worker thread, got {workers}")
+        self.workers = workers
+        self.thread_sensitive = thread_sensitive
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._executor = None
+        # the counters are updated from the worker threads
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        with db_call_measured(func):
+            return await self._run(func, *args, **kwargs)
+
+    async def _run(self, func, *args, **kwargs):
+        if self.thread_sensitive:
+            return await sync_to_async(func)(*args, **kwargs)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+        # context variables set by the caller are visible to the query, as with sync_to_async
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self._call, time.monotonic(), func, *args, **kwargs)
+        with self._lock:
+            self.queued += 1
+        return await asyncio.get_event_loop().run_in_executor(self._executor, call)
+
+    def _call(self, enqueued_at: float, func, *args, **kwargs):
+        wait = time.monotonic() - enqueued_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        failed = False
+        try:
+            close_old_connections()
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.failed += failed
+
+    def stats(self) -> dict:
+        started = self.completed + self.running
+        return {
+            'workers': self.workers,
+            'thread_sensitive': self.thread_sensitive,
+            'queued': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_seconds': self.total_wait / started if started else 0.0,
+            'max_wait_seconds': self.max_wait,
+        }
+
+
+def default_workers() -> int:
+    # SQLite fails write transactions that overlap with "database is locked", so unless DB_WORKERS says
+    # otherwise its queries stay on one thread.
+    return 0 if connections['default'].vendor == 'sqlite' else 8
+
+
+# DB_WORKERS=0 keeps every query on asgiref's thread-sensitive thread.
+DB_WORKERS = int(os.getenv("DB_WORKERS") or default_workers())
+DB = DatabaseExecutor(DB_WORKERS, thread_sensitive=DB_WORKERS == 0)
+
+
+def db_call(func):
+    """
+    Turns a blocking ORM function into a coroutine function that runs it on DB.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await DB.run(func, *args, **kwargs)
+    return wrapper
@@ -1,29 +1,32 @@
-from datetime import datetime
-
-from asgiref.sync import sync_to_async
 from botbuilder.dialogs import (
     ComponentDialog,
     DialogContext,
     DialogTurnResult,
-    DialogTurnStatus, WaterfallDialog, WaterfallStepContext, ChoicePrompt, ConfirmPrompt, PromptOptions
+    DialogTurnStatus, WaterfallStepContext, ChoicePrompt, ConfirmPrompt, PromptOptions
 )
 from botbuilder.schema import ActivityTypes, InputHints, HeroCard, CardAction, ActionTypes, Activity, Attachment, \
     ThumbnailCard, CardImage, AnimationCard, MediaUrl
 from botbuilder.core import MessageFactory, CardFactory
 
-from bot.models import Card, LearningMatrix
+from django.db import transaction
+
+from bot import stats
+from bot.content import get_card
+from bot.db import db_call
+from bot.metrics import MeteredWaterfallDialog
+from bot.models import Card, LearningMatrix, UserStats, UserDeck
 import logging
 
 
 class CancelAndHelpDialog(ComponentDialog):
     def __init__(self, dialog_id: str):
         super(CancelAndHelpDialog, self).__init__(dialog_id)
-        self.add_dialog(WaterfallDialog('InterruptionMenuDialog',
-                                        [self.show_help, self.process_interruption_choice, self.drop_step]))
+        self.add_dialog(MeteredWaterfallDialog('InterruptionMenuDialog',
+                                               [self.show_help, self.process_interruption_choice, self.drop_step]))
         self.add_dialog(ChoicePrompt('InterruptionChoice'))
         self.logger = logging.getLogger(self.__class__.__qualname__)
-        self.add_dialog(WaterfallDialog('DropDialog',
-                                        [self.confirmation_step, self.drop_step]))
+        self.add_dialog(MeteredWaterfallDialog('DropDialog',
+                                               [self.confirmation_step, self.drop_step]))
         self.add_dialog(ConfirmPrompt(ConfirmPrompt.__name__))
 
     async def on_continue_dialog(self, inner_dc: DialogContext) -> DialogTurnResult:
@@ -60,7 +63,6 @@ class CancelAndHelpDialog(ComponentDialog):
         current_card = step_context.options['current_card']
         # current_deck = await self.find_deck(current_card)
         user_id = step_context.context.activity.from_property.id
-        decks = await self.collect_user_decks(user_id)
         if step_context.result == "Drop the topic":
             return await self.confirmation_step(step_context)
         if step_context.result == "<< Back to topic":
@@ -73,6 +75,7 @@ class CancelAndHelpDialog(ComponentDialog):
             return await step_context.cancel_all_dialogs()
 
         if step_context.result == "My stats":
+            decks = await self.collect_user_decks(user_id)
             statistics = await self.get_statistics(user_id)
 
             reply = MessageFactory.list([])
@@ -126,7 +129,7 @@ class CancelAndHelpDialog(ComponentDialog):
     async def confirmation_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         self.logger.info('confirmation_step')
         current_card = step_context.options['current_card']
-        current_deck = await self.find_deck(current_card)
+        current_deck = await self.find_deck(step_context.context, current_card)
         step_context.values['card'] = current_card
         step_context.values['deck'] = current_deck
         step_context.values['command'] = step_context.context.activity.text.lower()
@@ -147,7 +150,8 @@ class CancelAndHelpDialog(ComponentDialog):
         if step_context.result:
             self.logger.info('step_context.result true')
             user_id = step_context.context.activity.from_property.id
-            await self.drop_topic(user_id, step_context.values['card'])
+            current_card = await get_card(step_context.context, step_context.values['card'])
+            await self.drop_topic(user_id, current_card)
             await step_context.context.send_activity(
                 MessageFactory.text(f"You have just dropped the topic {step_context.values['deck']}"))
             self.logger.info("end current dialog")
@@ -208,40 +212,35 @@ class CancelAndHelpDialog(ComponentDialog):
         )
         return CardFactory.animation_card(card)
 
-    @sync_to_async
+    @db_call
     def collect_user_decks(self, user):
-        titles = []
-        decks_set = LearningMatrix.objects.filter(user_id=user).values("deck_title").distinct()
-        for deck in decks_set:
-            titles.append(deck['deck_title'])
-        return titles
+        return list(UserDeck.objects.filter(user_id=user).order_by('id').values_list('deck__title', flat=True))
 
 
-    @sync_to_async
+    @db_call
     def get_statistics(self, user):
-        learning_objs = LearningMatrix.objects.filter(user_id=user)
-        learned_number = learning_objs.filter(easy_count__gt = 0).count()
-        learned_percent = learned_number / learning_objs.count() * 100
+        user_stats = UserStats.objects.filter(user_id=user).first() or UserStats(user_id=user)
         statistics = {
-            'cards': learning_objs.count(),
-            'started': learning_objs.filter(last_shown__lte=datetime.now().astimezone()).order_by(
-                'last_shown', '-hard_count').first().last_shown,
-            'already_learned': learned_percent
+            'cards': user_stats.cards,
+            'started': user_stats.started,
+            'already_learned': user_stats.learned / user_stats.cards * 100 if user_stats.cards else 0
         }
-        if statistics['started'] == datetime.utcfromtimestamp(0).astimezone():
+        if user_stats.unshown or user_stats.started is None:
             statistics['started'] = 'today'
         return statistics
 
-    @sync_to_async
-    def find_deck(self, card):
+    async def find_deck(self, turn_context, card_id):
+        card = await get_card(turn_context, card_id)
         return card.deck.title
 
-    @sync_to_async
+    @db_call
     def drop_topic(self, user_id: str, current_card: Card) -> bool:
         self.logger.info("drop_topic")
         if not current_card: return
         if not current_card.deck: return
         topic = current_card.deck.title
-        deleted, rows_count = LearningMatrix.objects.filter(user_id=user_id, deck_title=topic).delete()
+        with transaction.atomic():
+            deleted, rows_count = LearningMatrix.objects.filter(user_id=user_id, deck_id=current_card.deck_id).delete()
+            stats.dropped(user_id, current_card.deck_id)
         self.logger.info('deleted %d learning matrix cards for user=%s topic=%s', deleted, user_id, topic)
         return deleted
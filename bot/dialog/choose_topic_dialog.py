@@ -1,26 +1,31 @@
 import logging
 from datetime import datetime
 
-from asgiref.sync import sync_to_async
 from botbuilder.core import MessageFactory, CardFactory
 from botbuilder.dialogs import ComponentDialog, WaterfallDialog, \
     WaterfallStepContext, DialogTurnResult, PromptOptions, ChoicePrompt, Choice, ConfirmPrompt, DialogTurnStatus
 from botbuilder.schema import Attachment, CardAction, ActionTypes, HeroCard, AnimationCard, MediaUrl
-from django.db.models import Subquery
+from django.db import transaction
 
+from bot import content, stats
+from bot.db import db_call
+from bot.metrics import MeteredWaterfallDialog
 from bot.dialog.initial_learning import InitialLearningDialog
-from bot.models import Deck, Card, LearningMatrix, User
+from bot.models import Deck, Card, LearningMatrix, UserDeck
 from logging import getLogger
 
 logger = getLogger(__name__)
 
+# learning matrix rows inserted per statement when a user enrolls in a deck
+ENROLL_BATCH_SIZE = 500
+
 
 class ChooseTopicDialog(ComponentDialog):
     def __init__(self, dialog_id: str = None):
         super(ChooseTopicDialog, self).__init__(dialog_id or ChooseTopicDialog.__name__)
 
-        self.add_dialog(WaterfallDialog(WaterfallDialog.__name__,
-                                        [self.give_choice_step, self.confirm_choice_step, self.choose_again_step, self.loop]))
+        self.add_dialog(MeteredWaterfallDialog(WaterfallDialog.__name__,
+                                               [self.give_choice_step, self.confirm_choice_step, self.choose_again_step, self.loop]))
         self.add_dialog(ChoicePrompt(ChoicePrompt.__name__))
         self.add_dialog(ConfirmPrompt(ConfirmPrompt.__name__))
         self.initial_dialog_id = WaterfallDialog.__name__
@@ -66,11 +71,9 @@ class ChooseTopicDialog(ComponentDialog):
     async def choose_again_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         self.logger.info('choose_again_step')
         if step_context.result:
-            cards_list = await self.cards(step_context.values['deck_id'])
             user_id = step_context.context.activity.from_property.id
-            deck_title = step_context.values['deck']
             # add all cards of a chosen deck to learning matrix
-            await self.add_cards_to_learning_matrix(cards_list, user_id, deck_title)
+            await self.add_cards_to_learning_matrix(step_context.values['deck_id'], user_id)
             self.logger.info('begin dialog %s', InitialLearningDialog.__name__)
             return await step_context.begin_dialog(InitialLearningDialog.__name__)
         return await step_context.next(None)
@@ -104,42 +107,60 @@ class ChooseTopicDialog(ComponentDialog):
         return CardFactory.animation_card(card)
 
 
-    @sync_to_async
+    @db_call
     def not_learned_decks(self, user_id):
-        # retrieve deck titles that are in the learning matrix for a certain user
-        deck_in_progress = LearningMatrix.objects.filter(user=user_id).values("deck_title").distinct()
+        # retrieve decks the user is learning
+        deck_in_progress = set(UserDeck.objects.filter(user=user_id).values_list("deck_id", flat=True))
         # find all decks except those that are in progress
-        not_yet_chosen_decks = Deck.objects.exclude(title__in=Subquery(deck_in_progress))
+        not_yet_chosen_decks = [deck for deck in content.decks() if deck.id not in deck_in_progress]
         self.logger.info('%d not_learned_decks', len(not_yet_chosen_decks))
-        return list(not_yet_chosen_decks)
+        return not_yet_chosen_decks
 
-    @sync_to_async
+    @db_call
     def deck_id(self, deck_title):
-        try:
-            return Deck.objects.get(title=deck_title).id
-        except Deck.DoesNotExist:
-            raise
-
-    @sync_to_async
-    def cards(self, deck_id):
-        return list(Card.objects.filter(deck=deck_id))
+        for deck in content.decks():
+            if deck.title == deck_title:
+                return deck.id
+        raise Deck.DoesNotExist(f"no deck titled {deck_title}")
 
-    @sync_to_async
+    @db_call
     def cards_count(self, deck_id):
-        return len(list(Card.objects.filter(deck=deck_id)))
-
-    @sync_to_async
-    def add_cards_to_learning_matrix(self, cards_list, user_id, deck_title):
-        user = User.objects.get(pk=user_id)
-        for card in cards_list:
-            LearningMatrix(
-                user=user,
-                card=card,
-                deck_title=deck_title,
-                last_shown=datetime.utcfromtimestamp(0).astimezone(),
-                show_after=datetime.utcfromtimestamp(0).astimezone(),
-                show_count=0,
-                easy_count=0,
-                hard_count=0
-            ).save()
-        self.logger.info('added %d cards to learning matrix for user=%s topic=%s', len(cards_list),user_id, deck_title)
+        return content.cards_count(deck_id)
+
+    @db_call
+    def add_cards_to_learning_matrix(self, deck_id, user_id):
+        # only card ids are read, ENROLL_BATCH_SIZE rows are inserted per statement; cards that are already
+        # in the matrix (a repeated confirmation) are skipped by the (user, card) unique constraint.
+        # The ids are read before the transaction, which then starts with a write: on SQLite a transaction
+        # that reads first fails with "database is locked" when another one wrote meanwhile.
+        card_ids = list(Card.objects.filter(deck=deck_id).values_list('id', flat=True).order_by('id'))
+        never = datetime.utcfromtimestamp(0).astimezone()
+        with transaction.atomic():
+            for batch in chunked(card_ids, ENROLL_BATCH_SIZE):
+                LearningMatrix.objects.bulk_create([
+                    LearningMatrix(
+                        user_id=user_id,
+                        card_id=card_id,
+                        deck_id=deck_id,
+                        last_shown=never,
+                        show_after=never,
+                        show_count=0,
+                        easy_count=0,
+                        hard_count=0
+                    ) for card_id in batch
+                ], ignore_conflicts=True)
+            # the inserts do not tell how many rows they skipped, the recount of the topic does
+            added = stats.enrolled(user_id, deck_id)
+        self.logger.info('added %d cards to learning matrix for user=%s deck=%s', added, user_id, deck_id)
+        return added
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
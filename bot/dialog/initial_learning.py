@@ -1,26 +1,29 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from asgiref.sync import sync_to_async
 from botbuilder.core import MessageFactory, CardFactory
 from botbuilder.dialogs import WaterfallDialog, \
     WaterfallStepContext, DialogTurnResult, PromptOptions, ChoicePrompt, Choice, DialogTurnStatus
 from botbuilder.schema import Attachment, HeroCard, CardImage, CardAction, ActionTypes, AudioCard, MediaUrl, \
     ThumbnailUrl, AnimationCard
 
+from bot import reviews
+from bot.content import get_card, remember
+from bot.db import db_call
+from bot.metrics import MeteredWaterfallDialog
 from bot.state import CONVERSATION_STATE
 
 from bot.dialog.cancel_and_help_dialog import CancelAndHelpDialog
 from bot.dialog.quiz import QuizDialog
-from bot.models import LearningMatrix, Card
+from bot.models import LearningMatrix
 
 
 class InitialLearningDialog(CancelAndHelpDialog):
     def __init__(self, dialog_id: str = None):
         super(InitialLearningDialog, self).__init__(dialog_id or InitialLearningDialog.__name__)
 
-        self.add_dialog(WaterfallDialog(WaterfallDialog.__name__,
-                                        [self.show_card_step, self.show_answer_step, self.loop_step]))
+        self.add_dialog(MeteredWaterfallDialog(WaterfallDialog.__name__,
+                                               [self.show_card_step, self.show_answer_step, self.loop_step]))
         self.add_dialog(ChoicePrompt(ChoicePrompt.__name__))
         self.initial_dialog_id = WaterfallDialog.__name__
         self.current_card = CONVERSATION_STATE.create_property("CurrentCard")
@@ -29,22 +32,27 @@ class InitialLearningDialog(CancelAndHelpDialog):
     async def show_card_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         self.logger.info('show_card_step')
         user_id = step_context.context.activity.from_property.id
-        new_card = await self.card_to_show(user_id)
+        if step_context.options:
+            # loop_step already looked up the next card
+            new_card = await get_card(step_context.context, step_context.options)
+        else:
+            new_card = await self.card_to_show(user_id)
         if new_card is None:
             self.logger.info('no new card to show, replace current dialog with %s', 'ChooseTopicDialog')
             return await step_context.replace_dialog('ChooseTopicDialog')
-        await self.current_card.set(step_context.context, new_card)
-        await CONVERSATION_STATE.save_changes(step_context.context)
-        step_context.values['card'] = new_card
+        # dialog state keeps the card id only, the instance is looked up through bot.content when needed
+        remember(step_context.context, new_card)
+        await self.current_card.set(step_context.context, new_card.id)
+        step_context.values['card'] = new_card.id
 
         # a quiz question will be shown only if a card was already shown and learned, meaning that it's marked as easy
-        if await self.get_easy_count(new_card, user_id) > 0:
+        if await self.get_easy_count(new_card.id, user_id) > 0:
             self.logger.info('begin dialog %s',QuizDialog.__name__)
             step_context.values['quiz'] = True
-            return await step_context.begin_dialog(QuizDialog.__name__, new_card)
+            return await step_context.begin_dialog(QuizDialog.__name__, new_card.id)
         else:
-            pic_url = await self.get_image(new_card.id)
-            sound_url = await self.get_sound(new_card.id)
+            pic_url = new_card.url
+            sound_url = new_card.sound_url
             if sound_url and pic_url:
                 reply = MessageFactory.list([])
                 reply.attachments.append(self.create_audio_card(pic_url, sound_url, new_card))
@@ -68,9 +76,9 @@ class InitialLearningDialog(CancelAndHelpDialog):
     async def show_answer_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         self.logger.info('show_answer_step')
         if step_context.result:
-            card = step_context.values['card']
+            card = await get_card(step_context.context, step_context.values['card'])
             user_id = step_context.context.activity.from_property.id
-            await self.update_card_show_time(card, user_id)
+            await self.update_card_show_time(card.id, user_id)
             await step_context.context.send_activity(MessageFactory.text(f"{card.back}"))
             return await step_context.prompt(
                 ChoicePrompt.__name__,
@@ -88,11 +96,12 @@ class InitialLearningDialog(CancelAndHelpDialog):
             easiness = step_context.result.value
 
             await self.mark_easy_hard(step_context.values['card'], user_id, easiness)
-            if await self.card_to_show(user_id) is None:
+            next_card = await self.card_to_show(user_id)
+            if next_card is None:
                 reply = MessageFactory.list([])
                 reply.attachments.append(self.create_animation_card())
                 await step_context.context.send_activity(reply)
-                if step_context.values['quiz']:
+                if step_context.values.get('quiz'):
                     await step_context.context.send_activity(
                         MessageFactory.text("Yay! You have revised all cards in this topic."))
                 else:
@@ -101,8 +110,15 @@ class InitialLearningDialog(CancelAndHelpDialog):
                 self.logger.info('end current dialog')
                 return await step_context.end_dialog(True)
 
-        self.logger.info('replace current dialog with %s',InitialLearningDialog.__name__)
-        return await step_context.replace_dialog(InitialLearningDialog.__name__)
+            remember(step_context.context, next_card)
+            # restarts this dialog's own waterfall: replacing it with InitialLearningDialog, found in the parent
+            # dialog set, would nest one more InitialLearningDialog per card, and the help menu's "Back to topic"
+            # cannot reprompt a dialog its component does not contain
+            self.logger.info('replace current dialog with %s', WaterfallDialog.__name__)
+            return await step_context.replace_dialog(WaterfallDialog.__name__, next_card.id)
+
+        self.logger.info('replace current dialog with %s', WaterfallDialog.__name__)
+        return await step_context.replace_dialog(WaterfallDialog.__name__)
 
     def create_hero_card(self, pic_url, new_card) -> Attachment:
         card = HeroCard(
@@ -147,40 +163,23 @@ class InitialLearningDialog(CancelAndHelpDialog):
         )
         return CardFactory.animation_card(card)
 
-    @sync_to_async
+    @db_call
     def card_to_show(self, user):
-        lmx = LearningMatrix.objects.filter(user=user, show_after__lte=datetime.now().astimezone())
-        card_obj = lmx.order_by('last_shown', '-hard_count').first()
+        # served by the (user, last_shown, -hard_count, show_after) index: the rows are read in the order
+        # wanted and the scan stops at the first due one. Rows of a deleted deck are skipped, see bot.stats
+        lmx = LearningMatrix.objects.filter(user=user, show_after__lte=datetime.now().astimezone(), deck__isnull=False)
+        card_obj = lmx.order_by('last_shown', '-hard_count').select_related('card__deck').first()
         if card_obj:
             return card_obj.card
 
-    @sync_to_async
-    def get_sound(self, card):
-        return Card.objects.get(pk=card).sound_url
-
-    @sync_to_async
-    def get_image(self, card):
-        return Card.objects.get(pk=card).url
-
-    @sync_to_async
+    @db_call
     def get_easy_count(self, card, user):
         return LearningMatrix.objects.get(user=user, card=card).easy_count
 
-    @sync_to_async
+    @db_call
     def mark_easy_hard(self, card, user, easiness):
-        spaced_repetition = {1: 1, 2: 6, 3: 9, 4: 19}
-        lmx = LearningMatrix.objects.get(user=user, card=card)
-        if easiness == "Easy":
-            lmx.easy_count += 1
-            repeat_after_days = spaced_repetition.get(lmx.easy_count, 19)
-            lmx.show_after = datetime.now().astimezone() + timedelta(days=repeat_after_days)
-        else:
-            lmx.hard_count += 1
-        lmx.save()
+        reviews.card_marked(user, card, easiness == "Easy", datetime.now().astimezone())
 
-    @sync_to_async
+    @db_call
     def update_card_show_time(self, card, user):
-        lmx = LearningMatrix.objects.get(user=user, card=card)
-        lmx.last_shown = datetime.now().astimezone()
-        lmx.show_count += 1
-        lmx.save()
+        reviews.card_shown(user, card, datetime.now().astimezone())
@@ -1,23 +1,27 @@
 import logging
 
-from asgiref.sync import sync_to_async
 from botbuilder.core import MessageFactory, CardFactory
 from botbuilder.dialogs import ComponentDialog, WaterfallDialog, \
     WaterfallStepContext, DialogTurnResult, PromptOptions, TextPrompt, DialogTurnStatus
 from botbuilder.schema import Activity, ActivityTypes, Attachment, HeroCard, CardImage, CardAction, ActionTypes, \
     AudioCard, MediaUrl, ThumbnailUrl, AnimationCard
 from django.db.models import Subquery
+from django.db.models.functions import Coalesce
 
+from bot.answers import answer_index
+from bot.content import get_card, get_question, remember
+from bot.db import db_call
+from bot.metrics import MeteredWaterfallDialog
 from bot.dialog.cancel_and_help_dialog import CancelAndHelpDialog
-from bot.models import ShownQuestion, Question, User, Card
+from bot.models import LearningMatrix, Question
 
 
 class QuizDialog(CancelAndHelpDialog):
     def __init__(self, dialog_id: str = None):
         super(QuizDialog, self).__init__(dialog_id or QuizDialog.__name__)
 
-        self.add_dialog(WaterfallDialog(WaterfallDialog.__name__,
-                                        [self.show_question_step, self.check_answer_step, ]))
+        self.add_dialog(MeteredWaterfallDialog(WaterfallDialog.__name__,
+                                               [self.show_question_step, self.check_answer_step, ]))
         self.add_dialog(TextPrompt(TextPrompt.__name__))
         self.initial_dialog_id = WaterfallDialog.__name__
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -29,16 +33,15 @@ class QuizDialog(CancelAndHelpDialog):
             raise Exception("internal error, card not passed in")
         new_card = step_context.options
 
-        if await self.has_card_question(new_card):
-            self.logger.info("self.has_card_question(new_card) true")
-            question_to_ask = await self.get_question(new_card, user_id)
-            step_context.values['question'] = question_to_ask
-            # add this question to ShownQuestions
-            user_id = step_context.context.activity.from_property.id
-            await self.mark_question_as_shown(question_to_ask, user_id)
+        # the next question comes with its answers and is already marked as shown
+        question_to_ask = await self.next_question(new_card, user_id)
+        if question_to_ask is not None:
+            self.logger.info("card has a question")
+            remember(step_context.context, question_to_ask)
+            step_context.values['question'] = question_to_ask.id
             # show picture if there is any for the question
-            pic_url = await self.get_image(question_to_ask.id)
-            sound_url = await self.get_sound(question_to_ask.id)
+            pic_url = question_to_ask.url
+            sound_url = question_to_ask.sound_url
             if sound_url and pic_url:
                 reply = MessageFactory.list([])
                 reply.attachments.append(self.create_audio_card(sound_url, pic_url, question_to_ask))
@@ -52,10 +55,10 @@ class QuizDialog(CancelAndHelpDialog):
             elif pic_url:
                 self.logger.info("pic_url")
                 # show question with all answers it has if the question type is 'BTN'
-                many_answers = await self.has_buttons(question_to_ask)
+                many_answers = question_to_ask.type == Question.BUTTON
                 if many_answers:
                     self.logger.info("many_answer")
-                    all_answers = await self.get_answers(question_to_ask)
+                    all_answers = list(question_to_ask.answers.all())
                     reply = MessageFactory.list([])
                     reply.attachments.append(self.create_hero_card(pic_url, question_to_ask, all_answers))
                     await step_context.context.send_activity(reply)
@@ -96,7 +99,8 @@ class QuizDialog(CancelAndHelpDialog):
         else:
             self.logger.info("step_context.result != No")
             user_answer = step_context.result
-            is_correct = await self.check_answer(user_answer, step_context.values['question'])
+            question = await get_question(step_context.context, step_context.values['question'])
+            is_correct = self.check_answer(user_answer, question)
             if is_correct:
                 self.logger.info("is correct")
                 reply = MessageFactory.list([])
@@ -109,10 +113,10 @@ class QuizDialog(CancelAndHelpDialog):
                 self.logger.info("not is correct")
                 await step_context.context.send_activity(MessageFactory.text(":exclamation: Not correct."))
                 # show one of the correct answers if the back of the card is different. Else show the back of the card only
-                question = step_context.values['question']
-                if await self.correct_answer_is_different(question):
+                card = await get_card(step_context.context, question.card_id)
+                if self.correct_answer_is_different(question, card):
                     self.logger.info("correct_answer_is_different")
-                    correct_answer = await self.correct_answer(step_context.values['question'])
+                    correct_answer = self.correct_answer(question)
                     await step_context.context.send_activity(MessageFactory.text(f"Correct answer is: {correct_answer}"))
                 self.logger.info("end dialog")
                 return await step_context.end_dialog(True)
@@ -171,55 +175,30 @@ class QuizDialog(CancelAndHelpDialog):
         )
         return CardFactory.animation_card(card)
 
-    @sync_to_async
-    def get_answers(self, question):
-        return list(question.answers.all())
+    # the answers of a question come prefetched through bot.content, so grading does not query
 
-    @sync_to_async
-    def has_buttons(self, question):
-        return Question.objects.get(pk=question.id).type == 'BTN'
-
-    @sync_to_async
-    def get_image(self, question):
-        return Question.objects.get(pk=question).url
-
-    @sync_to_async
-    def get_sound(self, question):
-        return Question.objects.get(pk=question).sound_url
-
-    @sync_to_async
     def correct_answer(self, question):
-        if question.answers.count() == 1:
-            return question.answers.first()
-        else:
-            return question.answers.filter(correct=True).first()
+        return answer_index(question).correct_answer
 
-    @sync_to_async
-    def correct_answer_is_different(self, question):
-        card_back = Card.objects.get(pk=question.card_id).back
-        return not question.answers.filter(text__iexact=card_back).exists()
+    def correct_answer_is_different(self, question, card):
+        return not answer_index(question).has_answer(card.back)
 
-    @sync_to_async
     def check_answer(self, user_answer, question):
-        correct_answers = question.answers.filter(correct=True)
-        is_correct = correct_answers.filter(text__iexact=user_answer).exists()
-        return is_correct
-
-    @sync_to_async
-    def has_card_question(self, card):
-        return Question.objects.filter(card=card).count()
-
-    @sync_to_async
-    def mark_question_as_shown(self, question, user_id):
-        user = User.objects.get(pk=user_id)
-        card = Card.objects.get(pk=question.card_id)
-        ShownQuestion(user=user, card=card, question=question).save()
-
-    @sync_to_async
-    def get_question(self, card, user):
-        shown_questions = ShownQuestion.objects.filter(user=user, card=card).values("question_id")
-        questions = Question.objects.filter(card=card).exclude(id__in=Subquery(shown_questions))
-        if not questions.count():
-            ShownQuestion.objects.filter(user=user, card=card).delete()
-            questions = Question.objects.filter(card=card)
-        return questions.first()
+        return answer_index(question).is_correct(user_answer)
+
+    @db_call
+    def next_question(self, card, user):
+        """
+        Picks the question of the card that follows the one the user saw last, prefetches its answers and
+        moves the user's cursor to it. Returns None if the card has no questions.
+        """
+        questions = Question.objects.filter(card=card).order_by('id').prefetch_related('answers')
+        cursor = LearningMatrix.objects.filter(user=user, card=card).values('question_cursor')
+        question = questions.filter(id__gt=Coalesce(Subquery(cursor), 0)).first()
+        if question is None:
+            # every question was shown, start over
+            question = questions.first()
+            if question is None:
+                return None
+        LearningMatrix.objects.filter(user=user, card=card).update(question_cursor=question.id)
+        return question
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+
+class ConversationDispatcher:
+    """
+    Orders turns per conversation. Turns of different conversations run in parallel, while turns of one
+    conversation run one after another in the order they arrived, so two quick button taps cannot
+    interleave and overwrite each other's dialog state. All turns must run on the same event loop.
+    """
+
+    def __init__(self):
+        # conversation id -> future resolved when the last turn queued for that conversation finishes
+        self._tails: Dict[str, asyncio.Future] = {}
+
+    async def run(self, conversation_id: str, turn: Callable[[], Awaitable]):
+        if conversation_id is None:
+            return await turn()
+
+        previous = self._tails.get(conversation_id)
+        done = asyncio.get_event_loop().create_future()
+        self._tails[conversation_id] = done
+        try:
+            if previous is not None:
+                # shield so that cancelling this turn does not break the chain for the turns behind it
+                await asyncio.shield(previous)
+            return await turn()
+        finally:
+            if previous is None or previous.done():
+                self._release(conversation_id, done)
+            else:
+                # cancelled while waiting: the turns behind this one still wait for the previous turn
+                previous.add_done_callback(lambda _: self._release(conversation_id, done))
+
+    def _release(self, conversation_id: str, done: asyncio.Future):
+        done.set_result(None)
+        if self._tails.get(conversation_id) is done:
+            del self._tails[conversation_id]
+
+    @property
+    def active_conversations(self) -> int:
+        return len(self._tails)
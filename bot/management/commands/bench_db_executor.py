@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from bot import db
+from bot.db import DatabaseExecutor
+from bot.dialog.initial_learning import InitialLearningDialog
+from bot.models import Card, Deck, LearningMatrix, User
+from bot.simulation import benchmark_database
+
+
+class Command(BaseCommand):
+    help = "Runs due card lookups of many users at once on the thread-sensitive thread and on DB pools of " \
+           "different sizes, and reports lookups/sec and queue wait."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Users looking up cards at the same time")
+        parser.add_argument("--cards", type=int, default=2000, help="Learning matrix rows per user")
+        parser.add_argument("--lookups", type=int, default=20, help="Lookups per user")
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16], help="Pool sizes to compare")
+        parser.add_argument("--latency", type=float, default=2,
+                            help="Milliseconds added to every query, a stand-in for the network round trip to "
+                                 "a database server that a local SQLite file does not have")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user_ids = self.seed(options["users"], options["cards"])
+            self.add_latency(options["latency"] / 1000)
+            dialog = InitialLearningDialog()
+            executors = [("thread-sensitive", DatabaseExecutor(1, thread_sensitive=True))] + \
+                        [(f"{workers} workers", DatabaseExecutor(workers)) for workers in options["workers"]]
+            original = db.DB
+            try:
+                for name, executor in executors:
+                    db.DB = executor
+                    elapsed = async_to_sync(self.run)(dialog, user_ids, options["lookups"])
+                    stats = executor.stats()
+                    self.stdout.write(
+                        f"{name:16} {len(user_ids) * options['lookups'] / elapsed:8.0f} lookups/sec | "
+                        f"queue wait avg {stats['avg_wait_seconds'] * 1000:.2f} ms "
+                        f"max {stats['max_wait_seconds'] * 1000:.2f} ms")
+            finally:
+                db.DB = original
+
+    def add_latency(self, seconds):
+        def wait(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def add_to(connection, **kwargs):
+            connection.execute_wrappers.append(wait)
+
+        # every worker thread opens its own connection
+        connection_created.connect(add_to, weak=False)
+        add_to(connection)
+
+    async def run(self, dialog, user_ids, lookups):
+        async def user(user_id):
+            for _ in range(lookups):
+                await dialog.card_to_show(user_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in user_ids))
+        return time.perf_counter() - start
+
+    def seed(self, users, cards):
+        rng = random.Random(1)
+        deck = Deck.objects.create(title="Benchmark")
+        Card.objects.bulk_create([Card(deck=deck, front=f"Front {n}", back=f"Back {n}") for n in range(cards)])
+        card_ids = list(Card.objects.values_list("id", flat=True))
+        now = datetime.now().astimezone()
+        user_ids = []
+        for n in range(users):
+            user = User.objects.create(user_id=f"db-{n}")
+            LearningMatrix.objects.bulk_create([
+                LearningMatrix(user=user, card_id=card_id, deck=deck,
+                               last_shown=now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+                               show_after=now + timedelta(days=1 - rng.randrange(2)),
+                               show_count=1, easy_count=1, hard_count=rng.randrange(3))
+                for card_id in card_ids])
+            user_ids.append(user.user_id)
+        return user_ids
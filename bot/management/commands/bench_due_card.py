@@ -0,0 +1,80 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot.dialog.initial_learning import InitialLearningDialog
+from bot.models import Card, Deck, LearningMatrix, User
+from bot.simulation import benchmark_database, percentile
+
+DUE_INDEX_FIELDS = ['user', 'last_shown', '-hard_count', 'show_after']
+
+
+class Command(BaseCommand):
+    help = "Measures the next due card lookup of InitialLearningDialog for users with large learning matrices, " \
+           "with and without the due card index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5, help="Simulated users")
+        parser.add_argument("--cards", type=int, default=10000, help="Learning matrix rows per user")
+        parser.add_argument("--due", type=float, default=2, help="Percent of rows that are due")
+        parser.add_argument("--lookups", type=int, default=200, help="Lookups per user")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user_ids = self.seed(options["users"], options["cards"], options["due"])
+            dialog = InitialLearningDialog()
+            card_to_show = async_to_sync(dialog.card_to_show)
+
+            self.report("with index", self.run(card_to_show, user_ids, options["lookups"]))
+            self.explain(user_ids[0])
+
+            index = next(index for index in LearningMatrix._meta.indexes if index.fields == DUE_INDEX_FIELDS)
+            with connection.schema_editor() as schema_editor:
+                schema_editor.remove_index(LearningMatrix, index)
+            self.report("no index", self.run(card_to_show, user_ids, options["lookups"]))
+            self.explain(user_ids[0])
+
+    def seed(self, users, cards, due_percent):
+        rng = random.Random(1)
+        deck = Deck.objects.create(title="Benchmark")
+        Card.objects.bulk_create(
+            [Card(deck=deck, front=f"Front {n}", back=f"Back {n}") for n in range(cards)], batch_size=400)
+        card_ids = list(Card.objects.values_list("id", flat=True))
+        now = datetime.now().astimezone()
+        user_ids = []
+        for n in range(users):
+            user = User.objects.create(user_id=f"due-{n}")
+            rows = []
+            for card_id in card_ids:
+                due = rng.random() * 100 < due_percent
+                rows.append(LearningMatrix(
+                    user=user, card_id=card_id, deck=deck,
+                    last_shown=now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+                    show_after=now - timedelta(minutes=1) if due else now + timedelta(days=rng.randrange(1, 30)),
+                    show_count=1, easy_count=1, hard_count=rng.randrange(3)))
+            LearningMatrix.objects.bulk_create(rows, batch_size=400)
+            user_ids.append(user.user_id)
+        return user_ids
+
+    def run(self, card_to_show, user_ids, lookups):
+        timings = []
+        for user_id in user_ids:
+            for _ in range(lookups):
+                start = time.perf_counter()
+                card_to_show(user_id)
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    def report(self, name, timings):
+        self.stdout.write(
+            f"{name:10} {len(timings)} lookups | ms/lookup p50 {percentile(timings, 50) * 1000:.3f} "
+            f"p95 {percentile(timings, 95) * 1000:.3f} p99 {percentile(timings, 99) * 1000:.3f}")
+
+    def explain(self, user_id):
+        query = LearningMatrix.objects.filter(user=user_id, show_after__lte=datetime.now().astimezone()) \
+            .order_by('last_shown', '-hard_count')[:1]
+        self.stdout.write(f"  plan: {query.explain()}")
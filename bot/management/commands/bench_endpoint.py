@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bot.asgi import BotMessagesApp
+from bot.bot import BOT, on_error
+from bot.simulation import LocalAdapter, benchmark_database, learning_script, message_activity, seed_content
+
+
+class Command(BaseCommand):
+    help = "Compares turns/sec of the async_to_sync Django view path with the native ASGI endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Concurrent simulated users per run")
+        parser.add_argument("--cards", type=int, default=5, help="Cards in the deck every user learns")
+        parser.add_argument("--threads", type=int, default=8, help="Worker threads of the sync view run")
+        parser.add_argument("--latency", type=float, default=0.05,
+                            help="Seconds every send to the channel takes, 0 for an in-process connector")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            deck = seed_content(decks=1, cards=options["cards"], questions=0)[0]
+            script = learning_script(deck.title, options["cards"])
+            adapter = LocalAdapter(latency=options["latency"])
+            self.errors = 0
+
+            async def count_error(context, error):
+                self.errors += 1
+                await on_error(context, error)
+
+            adapter.on_turn_error = count_error
+
+            failed = 0
+            for name, run in (("async_to_sync view", lambda: self.run_sync_view(adapter, script, options["users"],
+                                                                                  options["threads"])),
+                              ("native ASGI", lambda: self.run_asgi(adapter, script, options["users"]))):
+                self.errors = 0
+                turns, elapsed = run()
+                self.report(name, turns, elapsed)
+                failed += self.errors
+        if failed:
+            raise CommandError(f"{failed} turns failed")
+
+    def report(self, name, turns, elapsed):
+        self.stdout.write(f"{name:20} {turns} turns in {elapsed:.2f}s, {turns / elapsed:.1f} turns/sec | "
+                          f"{self.errors} errors")
+
+    def run_sync_view(self, adapter, script, users, threads):
+        # Mirrors views.get_bot_response: a thread per request, each turn on its own event loop.
+        process_activity = async_to_sync(adapter.process_activity)
+
+        def converse(user_id):
+            for text in script:
+                process_activity(message_activity(user_id, text), "", BOT.on_turn)
+            connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(converse, [f"sync-{n}" for n in range(users)]))
+        return users * len(script), time.perf_counter() - start
+
+    def run_asgi(self, adapter, script, users):
+        app = BotMessagesApp(adapter, BOT)
+
+        async def post(activity):
+            body = json.dumps(activity.serialize()).encode()
+            scope = {"type": "http", "method": "POST", "path": "/api/messages",
+                     "headers": [(b"content-type", b"application/json")]}
+
+            async def receive():
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start" and message["status"] != 200:
+                    raise RuntimeError(f"unexpected status {message['status']}")
+
+            await app(scope, receive, send)
+
+        async def converse(user_id):
+            for text in script:
+                await post(message_activity(user_id, text))
+
+        async def run():
+            await asyncio.gather(*(converse(f"asgi-{n}") for n in range(users)))
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        return users * len(script), time.perf_counter() - start
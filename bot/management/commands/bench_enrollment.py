@@ -0,0 +1,51 @@
+import time
+from datetime import datetime
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from bot.dialog.choose_topic_dialog import ChooseTopicDialog
+from bot.models import Card, Deck, LearningMatrix, User
+from bot.simulation import benchmark_database
+
+
+class Command(BaseCommand):
+    help = "Times enrolling a user in decks of different sizes, row by row and in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="Cards per deck")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            dialog = ChooseTopicDialog()
+            cards_count = async_to_sync(dialog.cards_count)
+            enroll = async_to_sync(dialog.add_cards_to_learning_matrix)
+            for size in options["sizes"]:
+                deck = Deck.objects.create(title=f"Deck {size}")
+                Card.objects.bulk_create([Card(deck=deck, front=f"Front {n}", back=f"Back {n}") for n in range(size)])
+
+                start = time.perf_counter()
+                count = cards_count(deck.id)
+                count_seconds = time.perf_counter() - start
+
+                user = User.objects.create(user_id=f"row-{size}")
+                start = time.perf_counter()
+                self.enroll_row_by_row(deck, user)
+                row_seconds = time.perf_counter() - start
+
+                user = User.objects.create(user_id=f"bulk-{size}")
+                start = time.perf_counter()
+                enroll(deck.id, user.user_id)
+                bulk_seconds = time.perf_counter() - start
+
+                self.stdout.write(
+                    f"{count:6} cards | count {count_seconds * 1000:.1f} ms | "
+                    f"row by row {row_seconds * 1000:.0f} ms | bulk {bulk_seconds * 1000:.0f} ms "
+                    f"({row_seconds / bulk_seconds:.0f}x)")
+
+    def enroll_row_by_row(self, deck, user):
+        # what ChooseTopicDialog did before bulk enrollment, as a reference
+        never = datetime.utcfromtimestamp(0).astimezone()
+        for card in list(Card.objects.filter(deck=deck)):
+            LearningMatrix(user=user, card=card, deck=deck, last_shown=never, show_after=never,
+                           show_count=0, easy_count=0, hard_count=0).save()
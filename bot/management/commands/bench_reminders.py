@@ -0,0 +1,66 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from botbuilder.core import TurnContext
+from django.core.management.base import BaseCommand
+
+from bot.models import ConversationReferenceItem, LearningMatrix, User
+from bot.references import ConversationReferenceStore
+from bot.reminders import ReminderScheduler
+from bot.simulation import LocalAdapter, benchmark_database, message_activity, seed_content
+
+
+class Command(BaseCommand):
+    help = "Sends due card reminders through a local connector one user at a time and with the reminder " \
+           "scheduler, and reports reminders/sec."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Users with a stored conversation reference")
+        parser.add_argument("--cards", type=int, default=10, help="Learning matrix rows per user")
+        parser.add_argument("--latency", type=float, default=20, help="Milliseconds per send to the channel")
+        parser.add_argument("--concurrency", type=int, default=50, help="Reminders in flight")
+        parser.add_argument("--rate", type=float, default=1000, help="Reminders per second per channel")
+        parser.add_argument("--batch-size", type=int, default=500, help="Due users per query")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            references = self.seed(options["users"], options["cards"])
+            adapter = LocalAdapter(latency=options["latency"] / 1000)
+            runs = (
+                ("one at a time", ReminderScheduler(adapter, references, concurrency=1,
+                                                    batch_size=options["batch_size"], default_rate=options["rate"])),
+                ("scheduler", ReminderScheduler(adapter, references, concurrency=options["concurrency"],
+                                                batch_size=options["batch_size"], default_rate=options["rate"],
+                                                on_progress=self.progress)),
+            )
+            for name, scheduler in runs:
+                start = time.perf_counter()
+                stats = async_to_sync(scheduler.run)()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{name:14} {stats['sent']} sent, {stats['skipped']} skipped in {elapsed:.2f} s | "
+                                  f"{stats['sent'] / elapsed:.0f} reminders/sec")
+
+    def progress(self, stats):
+        self.stdout.write(f"  {stats['due_users']} due users, {stats['sent']} sent, "
+                          f"{stats['sent_per_second']:.0f}/sec")
+
+    def seed(self, users, cards):
+        deck = seed_content(decks=1, cards=cards, questions=0)[0]
+        card_ids = list(deck.cards.values_list("id", flat=True))
+        now = datetime.now().astimezone()
+        User.objects.bulk_create([User(user_id=f"reminder-{n}") for n in range(users)])
+        items = []
+        for n in range(users):
+            user_id = f"reminder-{n}"
+            # every tenth user has nothing due and gets no reminder
+            show_after = now + timedelta(days=1) if n % 10 == 0 else now - timedelta(hours=1)
+            LearningMatrix.objects.bulk_create([
+                LearningMatrix(user_id=user_id, card_id=card_id, deck=deck, last_shown=now, show_after=show_after,
+                               show_count=1, easy_count=1, hard_count=0) for card_id in card_ids])
+            reference = TurnContext.get_conversation_reference(message_activity(user_id, ""))
+            items.append(ConversationReferenceItem(user_id=user_id, channel_id=reference.channel_id,
+                                                   document=json.dumps(reference.serialize(), sort_keys=True)))
+        ConversationReferenceItem.objects.bulk_create(items, batch_size=100)
+        return ConversationReferenceStore()
@@ -0,0 +1,57 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from bot.models import Card, Deck, LearningMatrix, User
+from bot.scheduling import FixedIntervals, SM2Intervals, reschedule
+from bot.simulation import benchmark_database
+
+
+class Command(BaseCommand):
+    help = "Moves a learning matrix from the fixed schedule to the SM-2 style one row by row and with the " \
+           "batch rescheduler, and reports rows/sec."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Simulated users")
+        parser.add_argument("--cards", type=int, default=2000, help="Learned cards per user")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Rows per chunk of the batch rescheduler")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.seed(options["users"], options["cards"])
+            rows = LearningMatrix.objects.count()
+
+            elapsed = self.row_by_row(SM2Intervals())
+            self.stdout.write(f"row by row     {rows} rows in {elapsed:.2f} s | {rows / elapsed:8.0f} rows/sec")
+
+            result = reschedule(FixedIntervals(), chunk_size=options["chunk_size"])
+            self.stdout.write(f"batch          {result['rows']} rows in {result['seconds']:.2f} s | "
+                              f"{result['rows_per_second']:8.0f} rows/sec, {result['updated']} updated")
+            result = reschedule(FixedIntervals(), chunk_size=options["chunk_size"])
+            self.stdout.write(f"batch, no-op   {result['rows']} rows in {result['seconds']:.2f} s | "
+                              f"{result['rows_per_second']:8.0f} rows/sec, {result['updated']} updated")
+
+    def row_by_row(self, scheduler):
+        start = time.perf_counter()
+        for lmx in LearningMatrix.objects.filter(easy_count__gte=1).iterator():
+            lmx.show_after = scheduler.show_after(lmx.last_shown, lmx.easy_count, lmx.hard_count)
+            lmx.save(update_fields=['show_after'])
+        return time.perf_counter() - start
+
+    def seed(self, users, cards):
+        rng = random.Random(1)
+        deck = Deck.objects.create(title="Benchmark")
+        Card.objects.bulk_create(
+            [Card(deck=deck, front=f"Front {n}", back=f"Back {n}") for n in range(cards)], batch_size=400)
+        card_ids = list(Card.objects.values_list("id", flat=True))
+        now = datetime.now().astimezone()
+        for n in range(users):
+            user = User.objects.create(user_id=f"reschedule-{n}")
+            LearningMatrix.objects.bulk_create([
+                LearningMatrix(user=user, card_id=card_id, deck=deck,
+                               last_shown=now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+                               show_after=now, show_count=1, easy_count=1 + rng.randrange(6),
+                               hard_count=rng.randrange(4))
+                for card_id in card_ids], batch_size=100)
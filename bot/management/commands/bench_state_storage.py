@@ -0,0 +1,106 @@
+import json
+import statistics
+import time
+from copy import deepcopy
+
+from asgiref.sync import async_to_sync
+from botbuilder.core import MemoryStorage, Storage
+from django.core.management.base import BaseCommand
+from jsonpickle.pickler import Pickler
+
+from bot.bot import BOT, on_error
+from bot.simulation import LocalAdapter, benchmark_database, learning_script, make_cards_due, message_activity, \
+    percentile, review_script, seed_content
+from bot.state import CONVERSATION_STATE, USER_STATE
+from bot.storage import DjangoStorage
+
+
+class TimedStorage(Storage):
+    """
+    Wraps a storage and adds up the time spent in reads and writes, plus the serialized size and
+    deep copy time (what MemoryStorage pays on every write) of the written state.
+    """
+
+    def __init__(self, storage: Storage):
+        super(TimedStorage, self).__init__()
+        self.storage = storage
+        self.reset()
+
+    def reset(self):
+        self.reads = self.writes = 0
+        self.read_seconds = self.write_seconds = self.copy_seconds = 0.0
+        self.state_bytes = 0
+
+    async def read(self, keys):
+        start = time.perf_counter()
+        try:
+            return await self.storage.read(keys)
+        finally:
+            self.reads += 1
+            self.read_seconds += time.perf_counter() - start
+
+    async def write(self, changes):
+        self.state_bytes += len(json.dumps(Pickler().flatten(changes)))
+        start = time.perf_counter()
+        deepcopy(changes)
+        self.copy_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            return await self.storage.write(changes)
+        finally:
+            self.writes += 1
+            self.write_seconds += time.perf_counter() - start
+
+    async def delete(self, keys):
+        return await self.storage.delete(keys)
+
+
+class Command(BaseCommand):
+    help = "Measures bot state read/write latency, size and copy time per turn for MemoryStorage and DjangoStorage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Simulated users per storage")
+        parser.add_argument("--cards", type=int, default=10, help="Cards in each of the two decks")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            cards = options["cards"]
+            first, second = seed_content(decks=2, cards=cards, questions=1)
+            scripts = [learning_script(first.title, cards), review_script(second.title, cards, cards)]
+            for name, storage in (("memory", MemoryStorage()), ("database", DjangoStorage())):
+                self.report(name, self.run(TimedStorage(storage), scripts, options["users"], name))
+
+    def run(self, storage, scripts, users, prefix):
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        process_activity = async_to_sync(adapter.process_activity)
+        # the dialogs are bound to the shared state objects, so swap their storage for the run
+        original = CONVERSATION_STATE._storage, USER_STATE._storage
+        CONVERSATION_STATE._storage = USER_STATE._storage = storage
+        turns = []
+        try:
+            for n in range(users):
+                user_id = f"{prefix}-{n}"
+                for script in scripts:
+                    for text in script:
+                        storage.reset()
+                        process_activity(message_activity(user_id, text), "", BOT.on_turn)
+                        turns.append((storage.reads, storage.read_seconds, storage.writes, storage.write_seconds,
+                                      storage.state_bytes, storage.copy_seconds))
+                    # the first deck is learned, quizzes start once its cards are due
+                    make_cards_due(user_id)
+        finally:
+            CONVERSATION_STATE._storage, USER_STATE._storage = original
+        return turns
+
+    def report(self, name, turns):
+        reads, read_seconds, writes, write_seconds, state_bytes, copy_seconds = zip(*turns)
+        self.stdout.write(
+            f"{name:8} {len(turns)} turns | "
+            f"reads/turn {statistics.mean(reads):.1f}, read ms/turn p50 {percentile(read_seconds, 50) * 1000:.3f} "
+            f"p95 {percentile(read_seconds, 95) * 1000:.3f} | "
+            f"writes/turn {statistics.mean(writes):.1f}, write ms/turn p50 {percentile(write_seconds, 50) * 1000:.3f} "
+            f"p95 {percentile(write_seconds, 95) * 1000:.3f} | "
+            f"state bytes/turn avg {statistics.mean(state_bytes):.0f} max {max(state_bytes)}, "
+            f"copy ms/turn p50 {percentile(copy_seconds, 50) * 1000:.3f} p95 {percentile(copy_seconds, 95) * 1000:.3f}")
@@ -0,0 +1,81 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min, Q
+
+from bot import stats
+from bot.dialog.cancel_and_help_dialog import CancelAndHelpDialog
+from bot.dialog.choose_topic_dialog import ChooseTopicDialog
+from bot.models import Card, Deck, LearningMatrix, User
+from bot.simulation import benchmark_database, percentile
+
+
+class Command(BaseCommand):
+    help = "Times topic listing, stats and drop on a large learning matrix, next to the matrix scans they replace."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Simulated users")
+        parser.add_argument("--decks", type=int, default=30, help="Decks in the database")
+        parser.add_argument("--cards", type=int, default=200, help="Cards per deck")
+        parser.add_argument("--enrolled", type=int, default=6, help="Decks every user is learning")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user_ids, decks = self.seed(options)
+            self.stdout.write(f"{LearningMatrix.objects.count()} learning matrix rows")
+            choose_topic = ChooseTopicDialog()
+            help_dialog = CancelAndHelpDialog(CancelAndHelpDialog.__name__)
+
+            self.report("not learned topics", self.time(user_ids, async_to_sync(choose_topic.not_learned_decks)))
+            self.report("  matrix scan", self.time(user_ids, lambda user_id: list(
+                Deck.objects.exclude(id__in=LearningMatrix.objects.filter(user=user_id).values('deck_id').distinct()))))
+            self.report("topics in progress", self.time(user_ids, async_to_sync(help_dialog.collect_user_decks)))
+            self.report("  matrix scan", self.time(user_ids, lambda user_id: list(
+                LearningMatrix.objects.filter(user=user_id).values_list('deck__title', flat=True).distinct())))
+            self.report("my stats", self.time(user_ids, async_to_sync(help_dialog.get_statistics)))
+            self.report("  matrix scan", self.time(user_ids, lambda user_id: LearningMatrix.objects.filter(
+                user=user_id).aggregate(
+                cards=Count('id'), learned=Count('id', filter=Q(easy_count__gt=0)), started=Min('last_shown'))))
+
+            drop_topic = async_to_sync(help_dialog.drop_topic)
+            cards = {user_id: Card.objects.filter(deck=decks[user_id][0]).first() for user_id in user_ids}
+            self.report("drop topic", self.time(user_ids, lambda user_id: drop_topic(user_id, cards[user_id])))
+
+    def seed(self, options):
+        rng = random.Random(1)
+        decks = []
+        for n in range(options["decks"]):
+            deck = Deck.objects.create(title=f"Deck {n}")
+            Card.objects.bulk_create(
+                [Card(deck=deck, front=f"Front {n}.{c}", back=f"Back {n}.{c}") for c in range(options["cards"])])
+            decks.append(deck)
+        cards = {deck.id: list(deck.cards.values_list("id", flat=True)) for deck in decks}
+
+        now = datetime.now().astimezone()
+        user_decks = {}
+        for n in range(options["users"]):
+            user = User.objects.create(user_id=f"topics-{n}")
+            user_decks[user.user_id] = rng.sample(decks, options["enrolled"])
+            LearningMatrix.objects.bulk_create([
+                LearningMatrix(user=user, card_id=card_id, deck=deck, last_shown=now - timedelta(days=rng.randrange(30)),
+                               show_after=now, show_count=1, easy_count=rng.randrange(2), hard_count=0)
+                for deck in user_decks[user.user_id] for card_id in cards[deck.id]])
+        stats.rebuild()
+        return list(user_decks), user_decks
+
+    def time(self, user_ids, lookup):
+        if not hasattr(lookup, "awaitable"):
+            # take the same thread hop as the dialog helpers
+            lookup = async_to_sync(sync_to_async(lookup))
+        timings = []
+        for user_id in user_ids:
+            start = time.perf_counter()
+            lookup(user_id)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def report(self, name, timings):
+        self.stdout.write(f"{name:20} ms p50 {percentile(timings, 50) * 1000:.3f} p95 {percentile(timings, 95) * 1000:.3f}")
@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from bot import db
+from bot.bot import BOT, on_error
+from bot.db import DatabaseExecutor
+from bot.simulation import LocalAdapter, benchmark_database, journey_scripts, make_cards_due, message_activity, \
+    percentile, seed_content
+
+# queries of the turn the current task is running; the database threads see it through the copied context
+TURN_QUERIES = contextvars.ContextVar("turn_queries", default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = TURN_QUERIES.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Drives DialogBot with simulated users who learn a topic with hard answers, open help and stats, " \
+           "learn a second topic and take the quiz on the first, and reports turn latency percentiles, " \
+           "turns/sec and queries per turn, overall and per dialog step."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500, help="Simulated users")
+        parser.add_argument("--concurrency", type=int, default=50, help="Users talking to the bot at the same time")
+        parser.add_argument("--cards", type=int, default=5, help="Cards per topic")
+        parser.add_argument("--hard", type=float, default=20, help="Percent of answers that are Hard")
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the simulated users' choices")
+        parser.add_argument("--db-workers", type=int, default=db.DB_WORKERS,
+                            help="Database threads, 0 for the single thread-sensitive one; defaults to "
+                                 "DB_WORKERS")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            first, second = seed_content(decks=2, cards=options["cards"], questions=2)
+            rng = random.Random(options["seed"])
+            scripts = [journey_scripts(rng, first.title, second.title, options["cards"], options["hard"])
+                       for _ in range(options["users"])]
+            # every database thread opens its own connection
+            connection_created.connect(self.add_counter, weak=False)
+            for connection in connections.all():
+                self.add_counter(connection)
+
+            self.errors = 0
+            adapter = LocalAdapter()
+
+            async def count_error(context, error):
+                self.errors += 1
+                await on_error(context, error)
+
+            adapter.on_turn_error = count_error
+            workers = options["db_workers"]
+            turns = defaultdict(list)
+            original, db.DB = db.DB, DatabaseExecutor(workers, thread_sensitive=workers == 0)
+            try:
+                elapsed = async_to_sync(self.run)(adapter, scripts, options["concurrency"], turns)
+            finally:
+                db.DB = original
+            self.report(turns, elapsed)
+
+    def add_counter(self, connection, **kwargs):
+        if count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_query)
+
+    async def run(self, adapter, scripts, concurrency, turns):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def turn(user_id, step, text):
+            counter = [0]
+            token = TURN_QUERIES.set(counter)
+            start = time.perf_counter()
+            try:
+                await adapter.process_activity(message_activity(user_id, text), "", BOT.on_turn)
+            finally:
+                TURN_QUERIES.reset(token)
+            turns[step].append((time.perf_counter() - start, counter[0]))
+
+        async def user(n, learning, reviewing):
+            user_id = f"sim-{n}"
+            async with slots:
+                for step, text in learning:
+                    await turn(user_id, step, text)
+                await db.DB.run(make_cards_due, user_id)
+                for step, text in reviewing:
+                    await turn(user_id, step, text)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n, learning, reviewing) for n, (learning, reviewing) in enumerate(scripts)))
+        return time.perf_counter() - start
+
+    def report(self, turns, elapsed):
+        every = [result for results in turns.values() for result in results]
+        self.stdout.write(f"{len(every)} turns in {elapsed:.2f} s | {len(every) / elapsed:.1f} turns/sec | "
+                          f"{self.errors} errors")
+        self.stdout.write(f"{'step':14} {'turns':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for step, results in sorted(turns.items()) + [("all", every)]:
+            latencies = [latency * 1000 for latency, _ in results]
+            queries = statistics.mean(queries for _, queries in results)
+            self.stdout.write(f"{step:14} {len(results):7} {percentile(latencies, 50):8.1f} "
+                              f"{percentile(latencies, 95):8.1f} {percentile(latencies, 99):8.1f} {queries:8.1f}")
@@ -0,0 +1,84 @@
+import statistics
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot import db
+from bot.bot import BOT, on_error
+from bot.db import DatabaseExecutor
+from bot.simulation import LocalAdapter, benchmark_database, learning_script, message_activity, seed_content
+from bot.users import UserActivity
+
+WRITES = ("INSERT", "UPDATE", "DELETE")
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper that counts statements of a turn, writes and writes to the user table.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = self.writes = self.user_writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql.lstrip().upper().startswith(WRITES):
+            self.writes += 1
+            if '"bot_user"' in sql:
+                self.user_writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Counts database writes per turn with interaction times written on every turn and buffered."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Simulated users per run")
+        parser.add_argument("--cards", type=int, default=10, help="Cards in the deck")
+        parser.add_argument("--flush-seconds", type=float, default=60, help="Flush interval of the buffered run")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            deck = seed_content(decks=1, cards=options["cards"], questions=1)[0]
+            script = learning_script(deck.title, options["cards"])
+            for name, user_activity in (("every turn", UserActivity(flush_seconds=0)),
+                                        ("buffered", UserActivity(options["flush_seconds"]))):
+                self.report(name, self.run(user_activity, script, options["users"], name))
+
+    def run(self, user_activity, script, users, prefix):
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        process_activity = async_to_sync(adapter.process_activity)
+        counter = QueryCounter()
+        turns = []
+        original, BOT.user_activity = BOT.user_activity, user_activity
+        # queries run on this thread, whose connection the counter wraps
+        original_db, db.DB = db.DB, DatabaseExecutor(0, thread_sensitive=True)
+        try:
+            with connection.execute_wrapper(counter):
+                for n in range(users):
+                    user_id = f"{prefix}-{n}"
+                    for text in script:
+                        counter.reset()
+                        process_activity(message_activity(user_id, text), "", BOT.on_turn)
+                        turns.append((counter.queries, counter.writes, counter.user_writes))
+                counter.reset()
+                async_to_sync(user_activity.flush)()
+                # the final flush on shutdown is spread over all turns
+                final = counter.user_writes
+        finally:
+            BOT.user_activity = original
+            db.DB = original_db
+        return turns, final
+
+    def report(self, name, result):
+        turns, final = result
+        queries, writes, user_writes = zip(*turns)
+        self.stdout.write(
+            f"{name:10} {len(turns)} turns | queries/turn {statistics.mean(queries):.2f} | "
+            f"writes/turn {statistics.mean(writes):.2f} | "
+            f"user table writes/turn {(sum(user_writes) + final) / len(turns):.3f}")
@@ -0,0 +1,227 @@
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from bot.models import Answer, Card, Deck, LearningMatrix, Question, ReviewEvent, User, UserDeck, UserStats
+from bot.scheduling import SCHEDULER
+
+# in the order they are inserted, so foreign keys point at rows that exist
+GENERATED_MODELS = [Deck, Card, Question, Answer, User, LearningMatrix, ReviewEvent, UserDeck, UserStats]
+
+
+class Command(BaseCommand):
+    help = "Adds generated decks, cards, questions, answers, users, learning matrices and review histories to " \
+           "the database, for scale testing. The same seed and options always generate the same data, with times relative to now."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--decks", type=int, default=20, help="Decks to create")
+        parser.add_argument("--cards", type=int, default=100, help="Cards per deck")
+        parser.add_argument("--questions", type=int, default=2, help="Quiz questions per card")
+        parser.add_argument("--answers", type=int, default=3, help="Answers per question, the first one correct")
+        parser.add_argument("--users", type=int, default=1000, help="Users to create")
+        parser.add_argument("--topics", type=int, default=5, help="Most topics one user learns")
+        parser.add_argument("--days", type=int, default=180, help="Days of review history")
+        parser.add_argument("--no-events", action="store_true", help="Skip the review event log")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Rows inserted per transaction")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.rows = RowWriter(options["chunk_size"], self.progress)
+        self.events = not options["no_events"]
+        self.now = datetime.now().astimezone()
+        self.never = datetime.utcfromtimestamp(0).astimezone()
+        self.start = time.perf_counter()
+
+        decks = self.content(options["decks"], options["cards"], options["questions"], options["answers"])
+        self.learners(decks, options["users"], options["topics"], options["days"])
+        self.rows.flush()
+
+        # the database's own sequences continue after the generated keys
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), GENERATED_MODELS):
+                cursor.execute(sql)
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(f"inserted {self.rows.inserted} rows in {elapsed:.1f} s, "
+                          f"{self.rows.inserted / elapsed:.0f} rows/sec")
+
+    def progress(self, inserted):
+        self.stdout.write(f"{inserted} rows, {inserted / (time.perf_counter() - self.start):.0f} rows/sec")
+
+    def content(self, decks, cards, questions, answers):
+        """
+        Creates the decks and returns the card ids of each, with the question ids of each card.
+        """
+        deck_cards = []
+        for _ in range(decks):
+            deck_id = self.rows.add(Deck, title=f"Generated deck {self.rows.next_id(Deck)}")
+            cards_of_deck = []
+            for card_number in range(cards):
+                back = f"Back {deck_id}.{card_number}"
+                card_id = self.rows.add(Card, deck_id=deck_id, front=f"Front {deck_id}.{card_number}", back=back)
+                question_ids = []
+                for question_number in range(questions):
+                    question_id = self.rows.add(Question, card_id=card_id, text=f"Question {card_id}.{question_number}")
+                    question_ids.append(question_id)
+                    for n in range(answers):
+                        self.rows.add(Answer, question_id=question_id, correct=n == 0,
+                                      text=back if n == 0 else f"Wrong {card_id}.{n}")
+                cards_of_deck.append((card_id, question_ids))
+            deck_cards.append((deck_id, cards_of_deck))
+        return deck_cards
+
+    def learners(self, decks, users, topics, days):
+        """
+        Creates users enrolled in a few topics, popular ones more often, each with a learning matrix and the
+        review events behind it. Progress in a topic varies from just enrolled to done, and the last reviews
+        cluster in recent days, so show_after ranges from long overdue to weeks ahead.
+        """
+        # Zipf-like popularity of topics
+        weights = [1 / (rank + 1) for rank in range(len(decks))]
+        first_user = User.objects.filter(user_id__startswith="generated-").count()
+        for n in range(first_user, first_user + users):
+            user_id = f"generated-{n}"
+            enrolled = {self.rng.choices(range(len(decks)), weights)[0] for _ in range(self.rng.randint(1, topics))}
+            totals = {'cards': 0, 'learned': 0, 'unshown': 0}
+            started = last_seen = None
+            matrix = []
+            user_decks = []
+            for deck_index in sorted(enrolled):
+                deck_id, cards = decks[deck_index]
+                progress = self.rng.betavariate(1.2, 1.5)
+                deck_totals = {'cards': len(cards), 'learned': 0, 'unshown': 0}
+                for position, (card_id, question_ids) in enumerate(cards):
+                    history = self.card_history(question_ids, position < progress * len(cards), days)
+                    matrix.append((deck_id, card_id, history))
+                    deck_totals['learned'] += history['easy_count'] > 0
+                    deck_totals['unshown'] += history['show_count'] == 0
+                    if history['show_count']:
+                        started = min(started or history['last_shown'], history['last_shown'])
+                        last_seen = max(last_seen or history['last_shown'], history['last_shown'])
+                user_decks.append((deck_id, deck_totals))
+                for field in totals:
+                    totals[field] += deck_totals[field]
+
+            # the user comes first: a chunk may be flushed after any row, and must not refer to a later one
+            self.rows.add(User, user_id=user_id, last_interaction_time=last_seen or self.now)
+            for deck_id, deck_totals in user_decks:
+                self.rows.add(UserDeck, user_id=user_id, deck_id=deck_id, **deck_totals)
+            for deck_id, card_id, history in matrix:
+                shown = history.pop('reviews')
+                matrix_id = self.rows.add(LearningMatrix, user_id=user_id, card_id=card_id, deck_id=deck_id, **history)
+                if self.events:
+                    for when, easy in shown:
+                        self.rows.add(ReviewEvent, user_id=user_id, card_id=card_id, matrix_id=matrix_id,
+                                      kind=ReviewEvent.SHOWN, created=when)
+                        self.rows.add(ReviewEvent, user_id=user_id, card_id=card_id, matrix_id=matrix_id,
+                                      kind=ReviewEvent.EASY if easy else ReviewEvent.HARD, created=when)
+            self.rows.add(UserStats, user_id=user_id, started=started, **totals)
+
+    def card_history(self, question_ids, reviewed, days) -> dict:
+        """
+        Learning matrix values of a card and its reviews as (shown at, easy) pairs, computed the way
+        bot.reviews projects them: every show is followed by an easy or hard answer.
+        """
+        history = {'last_shown': self.never, 'show_after': self.never, 'show_count': 0, 'easy_count': 0,
+                   'hard_count': 0, 'question_cursor': None, 'reviews': []}
+        if not reviewed:
+            return history
+        count = 1 + min(int(self.rng.expovariate(0.4)), 15)
+        first = self.now - timedelta(days=self.rng.uniform(0, days))
+        last = self.now - timedelta(days=min(self.rng.expovariate(1 / 7), (self.now - first).days))
+        step = (last - first) / count
+        for review in range(count):
+            shown = first + step * (review + 1)
+            easy = self.rng.random() < 0.75
+            history['last_shown'] = shown
+            history['show_count'] += 1
+            if easy:
+                history['easy_count'] += 1
+                history['show_after'] = SCHEDULER.show_after(shown, history['easy_count'], history['hard_count'])
+            else:
+                history['hard_count'] += 1
+            history['reviews'].append((shown, easy))
+        if history['easy_count'] and question_ids:
+            history['question_cursor'] = self.rng.choice(question_ids)
+        return history
+
+
+class RowWriter:
+    """
+    Buffers rows as plain tuples and writes them with one executemany() per model and chunk, which skips
+    building model instances and compiling an INSERT per batch: on SQLite, 300k review events are written
+    at about 48k rows/sec this way and at about 17k rows/sec as instances saved with bulk_create(batch_size=100).
+    Auto-incremented primary keys are assigned here, continuing after the largest existing one, so rows can
+    refer to each other without reading them back. A chunk is committed as soon as it is full, so a row
+    must be added after the rows it refers to. Do not run it alongside other writers to the same tables.
+    """
+
+    def __init__(self, chunk_size: int, on_flush=None):
+        self.chunk_size = chunk_size
+        self.on_flush = on_flush
+        self.inserted = 0
+        self.buffered = 0
+        self._rows = defaultdict(list)
+        self._next_id = {}
+        self._fields = {}
+        self._defaults = {}
+        # connection is looked up per thread on every attribute access, which adds up over millions of rows
+        self._ops = connection.ops
+
+    def add(self, model, **values):
+        """
+        Buffers a row and returns its primary key. Fields that are not given get their default, computed
+        once per model.
+        """
+        fields = self._prepare(model)
+        if model in self._next_id:
+            values[model._meta.pk.attname] = self._next_id[model]
+            self._next_id[model] += 1
+        defaults = self._defaults[model]
+        row = []
+        for field in fields:
+            value = values.get(field.attname, defaults[field.attname])
+            if isinstance(value, datetime):
+                value = self._ops.adapt_datetimefield_value(value)
+            row.append(value)
+        self._rows[model].append(row)
+        self.buffered += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+        return values[model._meta.pk.attname]
+
+    def next_id(self, model) -> int:
+        """
+        The primary key the next row of an auto-incremented model gets.
+        """
+        self._prepare(model)
+        return self._next_id[model]
+
+    def _prepare(self, model):
+        fields = self._fields.get(model)
+        if fields is None:
+            fields = self._fields[model] = model._meta.concrete_fields
+            self._defaults[model] = {field.attname: field.get_default() for field in fields}
+            if model._meta.pk.get_internal_type() == 'AutoField':
+                self._next_id[model] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        return fields
+
+    def flush(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in GENERATED_MODELS:
+                rows = self._rows.pop(model, None)
+                if rows:
+                    columns = ", ".join(self._ops.quote_name(field.column) for field in self._fields[model])
+                    placeholders = ", ".join(["%s"] * len(self._fields[model]))
+                    cursor.executemany(f"INSERT INTO {self._ops.quote_name(model._meta.db_table)} "
+                                       f"({columns}) VALUES ({placeholders})", rows)
+        self.inserted += self.buffered
+        self.buffered = 0
+        if self.on_flush:
+            self.on_flush(self.inserted)
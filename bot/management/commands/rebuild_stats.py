@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bot import stats
+
+
+class Command(BaseCommand):
+    help = "Recounts the per user and per topic statistics from the learning matrix."
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", nargs="*", help="User ids to recount, everyone if omitted")
+
+    def handle(self, *args, **options):
+        users = stats.rebuild(options["users"] or None)
+        self.stdout.write(f"recounted statistics of {users} users")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from bot import reviews
+from bot.scheduling import SCHEDULER, SCHEDULERS
+
+
+class Command(BaseCommand):
+    help = "Recomputes the learning matrix from the review event log."
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", nargs="*", help="User ids to recompute, everyone if omitted")
+        parser.add_argument("--scheduler", choices=sorted(SCHEDULERS),
+                            help="Schedule to replay the easy answers with, the SCHEDULER setting if omitted")
+        parser.add_argument("--chunk-size", type=int, default=reviews.REPLAY_CHUNK_SIZE,
+                            help="Learning matrix rows per batch")
+
+    def handle(self, *args, **options):
+        scheduler = SCHEDULERS[options["scheduler"]]() if options["scheduler"] else SCHEDULER
+        result = reviews.replay(options["users"] or None, scheduler, options["chunk_size"])
+        self.stdout.write(f"replayed {result['events']} events of {result['rows']} cards, {result['updated']} changed")
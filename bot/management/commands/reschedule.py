@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bot.scheduling import RESCHEDULE_CHUNK_SIZE, SCHEDULER, SCHEDULERS, reschedule
+
+
+class Command(BaseCommand):
+    help = "Recomputes when every learned card is shown next, after the spaced repetition schedule changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", nargs="*", help="User ids to reschedule, everyone if omitted")
+        parser.add_argument("--scheduler", choices=sorted(SCHEDULERS),
+                            help="Schedule to apply, the SCHEDULER setting if omitted")
+        parser.add_argument("--chunk-size", type=int, default=RESCHEDULE_CHUNK_SIZE, help="Rows read per query")
+
+    def handle(self, *args, **options):
+        scheduler = SCHEDULERS[options["scheduler"]]() if options["scheduler"] else SCHEDULER
+        result = reschedule(scheduler, options["users"] or None, options["chunk_size"])
+        self.stdout.write(f"rescheduled {result['rows']} cards, {result['updated']} changed, "
+                          f"{result['rows_per_second']:.0f} rows/sec")
@@ -0,0 +1,265 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Sequence
+
+from botbuilder.core import BotFrameworkAdapter, TurnContext
+from botbuilder.dialogs import DialogTurnResult, WaterfallDialog, WaterfallStepContext
+from botbuilder.schema import Activity, ResourceResponse
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Turns are measured by MeteredAdapter: it puts a TurnMetrics in TURN for the duration of the turn, the
+# hooks below add to it from the event loop and, through the copied context, from the database threads,
+# and the finished turn is folded into the histograms of METRICS. Outside a turn, or with metrics turned
+# off, every hook costs one context variable lookup. The Prometheus text is only built when scraped.
+
+TURN = contextvars.ContextVar("turn_metrics", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with at most one label. Observing bumps one bucket under a lock, because
+    turns run on several threads' event loops when requests come through async_to_sync.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label: str = None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label = label
+        # label value -> count per bucket, the last one for +Inf, followed by the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str = ""):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, label_value: str = "") -> int:
+        with self._lock:
+            return sum(self._series.get(label_value, [0.0])[:-1])
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            snapshot = {label_value: list(series) for label_value, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(snapshot.items()):
+            labels = f'{self.label}="{escape(label_value)}"' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class BotMetrics:
+    """
+    The histograms behind /api/metrics. Turns are labelled by activity type, waterfall steps by the
+    qualified name of the step method, database helpers by function and state storage calls by operation.
+    """
+
+    def __init__(self):
+        self.turn_seconds = Histogram(
+            "bot_turn_seconds", "Wall time of a turn, from the adapter's middleware to the end of the bot's "
+            "on_turn", LATENCY_BUCKETS, "activity_type")
+        self.turn_db_queries = Histogram(
+            "bot_turn_db_queries", "Database queries per turn", COUNT_BUCKETS, "activity_type")
+        self.turn_db_query_seconds = Histogram(
+            "bot_turn_db_query_seconds", "Time per turn spent executing database queries", LATENCY_BUCKETS,
+            "activity_type")
+        self.turn_db_calls = Histogram(
+            "bot_turn_db_calls", "Calls per turn to database helpers, each a hop to a database thread",
+            COUNT_BUCKETS, "activity_type")
+        self.turn_state_round_trips = Histogram(
+            "bot_turn_state_round_trips", "State storage reads, writes and deletes per turn", COUNT_BUCKETS,
+            "activity_type")
+        self.turn_sends = Histogram(
+            "bot_turn_sends", "Calls per turn to the channel to send activities", COUNT_BUCKETS, "activity_type")
+        self.step_seconds = Histogram(
+            "bot_step_seconds", "Wall time of a waterfall step, including dialogs it begins", LATENCY_BUCKETS,
+            "step")
+        self.step_db_queries = Histogram(
+            "bot_step_db_queries", "Database queries per waterfall step, including dialogs it begins",
+            COUNT_BUCKETS, "step")
+        self.step_db_query_seconds = Histogram(
+            "bot_step_db_query_seconds", "Time per waterfall step spent executing database queries",
+            LATENCY_BUCKETS, "step")
+        self.db_call_seconds = Histogram(
+            "bot_db_call_seconds", "Wall time of a database helper call, including the wait for a thread",
+            LATENCY_BUCKETS, "function")
+        self.state_seconds = Histogram(
+            "bot_state_seconds", "Latency of a state storage round trip", LATENCY_BUCKETS, "operation")
+        self.send_seconds = Histogram(
+            "bot_send_seconds", "Latency of sending activities to the channel", LATENCY_BUCKETS)
+
+    def histograms(self) -> List[Histogram]:
+        return [value for value in vars(self).values() if isinstance(value, Histogram)]
+
+    def expose(self) -> str:
+        return "".join(line + "\n" for histogram in self.histograms() for line in histogram.expose())
+
+    def turn_finished(self, turn: "TurnMetrics", activity_type: str, seconds: float):
+        self.turn_seconds.observe(seconds, activity_type)
+        self.turn_db_queries.observe(turn.queries, activity_type)
+        self.turn_db_query_seconds.observe(turn.query_seconds, activity_type)
+        self.turn_db_calls.observe(turn.db_calls, activity_type)
+        self.turn_state_round_trips.observe(turn.state_round_trips, activity_type)
+        self.turn_sends.observe(turn.sends, activity_type)
+
+
+class TurnMetrics:
+    """
+    Counters of the turn in progress.
+    """
+
+    __slots__ = ("metrics", "queries", "query_seconds", "db_calls", "state_round_trips", "sends")
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.db_calls = 0
+        self.state_round_trips = 0
+        self.sends = 0
+
+
+METRICS = BotMetrics()
+
+
+class MeteredAdapter(BotFrameworkAdapter):
+    """
+    BotFrameworkAdapter that measures every turn it runs and every send to the channel in `metrics`.
+    Turns are measured in run_pipeline, which process_activity, process_activity_with_identity and
+    continue_conversation all go through, so the middleware and the error handler are included and
+    authentication is not. Without `metrics` it behaves like BotFrameworkAdapter.
+    """
+
+    def __init__(self, settings, metrics: BotMetrics = None):
+        super(MeteredAdapter, self).__init__(settings)
+        self.metrics = metrics
+
+    async def run_pipeline(self, context: TurnContext, callback: Callable[[TurnContext], Awaitable] = None):
+        if self.metrics is None:
+            return await super().run_pipeline(context, callback)
+        turn = TurnMetrics(self.metrics)
+        token = TURN.set(turn)
+        start = time.perf_counter()
+        try:
+            return await super().run_pipeline(context, callback)
+        finally:
+            TURN.reset(token)
+            activity_type = context.activity.type if context.activity else None
+            self.metrics.turn_finished(turn, activity_type or "", time.perf_counter() - start)
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        turn = TURN.get()
+        if turn is None:
+            return await super().send_activities(context, activities)
+        start = time.perf_counter()
+        try:
+            return await super().send_activities(context, activities)
+        finally:
+            turn.sends += 1
+            turn.metrics.send_seconds.observe(time.perf_counter() - start)
+
+
+class MeteredWaterfallDialog(WaterfallDialog):
+    """
+    WaterfallDialog that measures the wall time and database queries of each step. A step that begins
+    another dialog also counts the steps that run inside it.
+    """
+
+    async def on_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
+        turn = TURN.get()
+        if turn is None:
+            return await super().on_step(step_context)
+        queries, query_seconds = turn.queries, turn.query_seconds
+        start = time.perf_counter()
+        try:
+            return await super().on_step(step_context)
+        finally:
+            step = self.get_step_name(step_context.index)
+            turn.metrics.step_seconds.observe(time.perf_counter() - start, step)
+            turn.metrics.step_db_queries.observe(turn.queries - queries, step)
+            turn.metrics.step_db_query_seconds.observe(turn.query_seconds - query_seconds, step)
+
+
+@contextmanager
+def db_call_measured(func):
+    """
+    Measures a call to a database helper, see bot.db.DatabaseExecutor.run.
+    """
+    turn = TURN.get()
+    if turn is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        turn.db_calls += 1
+        turn.metrics.db_call_seconds.observe(time.perf_counter() - start, func.__qualname__)
+
+
+@contextmanager
+def state_round_trip(operation: str):
+    """
+    Measures a read, write or delete of the state storage, see bot.storage.DjangoStorage.
+    """
+    turn = TURN.get()
+    if turn is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        turn.state_round_trips += 1
+        turn.metrics.state_seconds.observe(time.perf_counter() - start, operation)
+
+
+def time_query(execute, sql, params, many, context):
+    turn = TURN.get()
+    if turn is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        turn.queries += 1
+        turn.query_seconds += time.perf_counter() - start
+
+
+def measure_queries():
+    """
+    Times the queries of turns on every database connection, including the ones the database threads
+    open later.
+    """
+    connection_created.connect(_add_query_timer, weak=False, dispatch_uid="bot.metrics")
+    for connection in connections.all():
+        _add_query_timer(connection)
+
+
+def _add_query_timer(connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_auto_20200721_1202'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateItem',
+            fields=[
+                ('key', models.CharField(max_length=1024, primary_key=True, serialize=False)),
+                ('document', models.TextField()),
+                ('e_tag', models.CharField(max_length=32)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_stateitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='learningmatrix',
+            index=models.Index(fields=['user', 'last_shown', '-hard_count', 'show_after'], name='bot_learnin_user_id_3b7191_idx'),
+        ),
+    ]
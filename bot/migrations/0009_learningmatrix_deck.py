@@ -0,0 +1,39 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def fill_deck(apps, schema_editor):
+    LearningMatrix = apps.get_model('bot', 'LearningMatrix')
+    Card = apps.get_model('bot', 'Card')
+    Deck = apps.get_model('bot', 'Deck')
+    LearningMatrix.objects.update(deck=Subquery(Card.objects.filter(pk=OuterRef('card')).values('deck')[:1]))
+    # cards that were taken out of their deck keep the topic they were learned in
+    LearningMatrix.objects.filter(deck__isnull=True).update(
+        deck=Subquery(Deck.objects.filter(title=OuterRef('deck_title')).order_by('id').values('id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_auto_20261018_0837'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningmatrix',
+            name='deck',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='learning_matrix', to='bot.Deck'),
+        ),
+        migrations.RunPython(fill_deck, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='learningmatrix',
+            name='deck_title',
+        ),
+        migrations.AddIndex(
+            model_name='learningmatrix',
+            index=models.Index(fields=['user', 'deck'], name='bot_learnin_user_id_ace2f1_idx'),
+        ),
+    ]
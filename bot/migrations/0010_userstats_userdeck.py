@@ -0,0 +1,60 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min, Q
+
+
+def count_stats(apps, schema_editor):
+    LearningMatrix = apps.get_model('bot', 'LearningMatrix')
+    UserStats = apps.get_model('bot', 'UserStats')
+    UserDeck = apps.get_model('bot', 'UserDeck')
+    # rows without a topic are not counted, as in bot.stats.rebuild
+    matrix = LearningMatrix.objects.filter(deck__isnull=False)
+    totals = {
+        'cards': Count('id'),
+        'learned': Count('id', filter=Q(easy_count__gt=0)),
+        'unshown': Count('id', filter=Q(show_count=0)),
+    }
+    UserDeck.objects.bulk_create(
+        [UserDeck(**row) for row in matrix.values('user_id', 'deck_id').order_by().annotate(**totals)],
+        batch_size=100)
+    UserStats.objects.bulk_create(
+        [UserStats(**row) for row in matrix.values('user_id').order_by().annotate(
+            started=Min('last_shown', filter=Q(show_count__gt=0)), **totals)],
+        batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_learningmatrix_deck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='bot.User')),
+                ('cards', models.IntegerField(default=0)),
+                ('learned', models.IntegerField(default=0)),
+                ('unshown', models.IntegerField(default=0)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserDeck',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cards', models.IntegerField(default=0)),
+                ('learned', models.IntegerField(default=0)),
+                ('unshown', models.IntegerField(default=0)),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='users', to='bot.Deck')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decks', to='bot.User')),
+            ],
+            options={
+                'unique_together': {('user', 'deck')},
+            },
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
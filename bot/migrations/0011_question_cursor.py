@@ -0,0 +1,32 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:48
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def move_shown_questions(apps, schema_editor):
+    # questions are shown in id order, so the highest shown id is where the rotation stopped
+    LearningMatrix = apps.get_model('bot', 'LearningMatrix')
+    ShownQuestion = apps.get_model('bot', 'ShownQuestion')
+    last_shown = ShownQuestion.objects.filter(user=OuterRef('user'), card=OuterRef('card')) \
+        .values('user', 'card').annotate(last=Max('question_id')).values('last')
+    LearningMatrix.objects.update(question_cursor=Subquery(last_shown))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_userstats_userdeck'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningmatrix',
+            name='question_cursor',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_shown_questions, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='ShownQuestion',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_question_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationReferenceItem',
+            fields=[
+                ('user_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('channel_id', models.CharField(max_length=255)),
+                ('document', models.TextField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def log_past_reviews(apps, schema_editor):
+    # Only the counters of past reviews are known, so each row gets as many events as its counters say,
+    # all at the time the card was last shown: shown, then hard, then easy, which replays to the counters
+    # and to a show time counted from last_shown with the final counts.
+    LearningMatrix = apps.get_model('bot', 'LearningMatrix')
+    ReviewEvent = apps.get_model('bot', 'ReviewEvent')
+    events = []
+    rows = LearningMatrix.objects.filter(show_count__gt=0).order_by('id').values_list(
+        'id', 'user_id', 'card_id', 'last_shown', 'show_count', 'easy_count', 'hard_count')
+    for matrix_id, user_id, card_id, last_shown, show_count, easy_count, hard_count in rows.iterator():
+        for kind, count in ((1, show_count), (3, hard_count), (2, easy_count)):
+            events.extend(ReviewEvent(user_id=user_id, card_id=card_id, matrix_id=matrix_id, kind=kind,
+                                      created=last_shown) for _ in range(count))
+        if len(events) >= 1000:
+            ReviewEvent.objects.bulk_create(events, batch_size=100)
+            events = []
+    ReviewEvent.objects.bulk_create(events, batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_conversationreferenceitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Shown'), (2, 'Easy'), (3, 'Hard')])),
+                ('created', models.DateTimeField()),
+                ('card', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='review_events', to='bot.Card')),
+                ('matrix', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='bot.LearningMatrix')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_events', to='bot.User')),
+            ],
+        ),
+        migrations.RunPython(log_past_reviews, migrations.RunPython.noop),
+    ]
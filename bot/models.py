@@ -65,33 +65,103 @@ class User(models.Model):
 class LearningMatrix(models.Model):
     user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='user')
     card = models.ForeignKey('Card', on_delete=models.CASCADE, related_name='card')
-    deck_title = models.CharField(max_length=255)
+    deck = models.ForeignKey('Deck', on_delete=models.SET_NULL, related_name='learning_matrix', blank=True, null=True)
     last_shown = DateTimeField()
     show_after = DateTimeField()
     show_count = IntegerField()
     easy_count = IntegerField()
     hard_count = IntegerField()
+    # id of the quiz question of the card shown last, the next one is the first with a greater id
+    question_cursor = IntegerField(blank=True, null=True)
 
     class Meta:
         unique_together = [['user', 'card']]
 
         indexes = [
             models.Index(fields=['user', 'card']),
+            # next due card lookup in InitialLearningDialog.card_to_show
+            models.Index(fields=['user', 'last_shown', '-hard_count', 'show_after']),
+            # rows of a topic, for drop_topic and stats
+            models.Index(fields=['user', 'deck']),
         ]
 
     def __str__(self):
         return f"{self.user} {self.card}"
 
 
-class ShownQuestion(models.Model):
-    user = models.ForeignKey('User', on_delete=models.CASCADE)
-    card = models.ForeignKey('Card', on_delete=models.CASCADE)
-    question = models.ForeignKey('Question', on_delete=models.CASCADE, related_name='question')
+class ReviewEvent(models.Model):
+    """
+    Append-only log of the cards shown to users and their answers. LearningMatrix counters and show times
+    are a projection of it, see bot.reviews.
+    """
+    SHOWN = 1
+    EASY = 2
+    HARD = 3
+    KINDS = [(SHOWN, 'Shown'), (EASY, 'Easy'), (HARD, 'Hard')]
+
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='review_events')
+    card = models.ForeignKey('Card', on_delete=models.CASCADE, related_name='review_events', db_index=False)
+    # the projected row; events of a dropped topic stay in the log without one
+    matrix = models.ForeignKey('LearningMatrix', on_delete=models.SET_NULL, related_name='events', blank=True, null=True)
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    created = DateTimeField()
+
+    def __str__(self):
+        return f"{self.user} {self.card} {self.get_kind_display()}"
+
+
+class StateItem(models.Model):
+    """
+    ConversationState and UserState documents stored by bot.storage.DjangoStorage.
+    """
+    key = models.CharField(max_length=1024, primary_key=True)
+    document = models.TextField()
+    e_tag = models.CharField(max_length=32)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+
+class ConversationReferenceItem(models.Model):
+    """
+    The last conversation reference of a user, stored by bot.references for proactive messages.
+    """
+    user_id = models.CharField(max_length=255, primary_key=True)
+    channel_id = models.CharField(max_length=255)
+    document = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.user_id
+
+
+class UserStats(models.Model):
+    """
+    Learning matrix totals of a user, kept up to date by bot.stats together with the matrix rows.
+    """
+    user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    cards = IntegerField(default=0)
+    learned = IntegerField(default=0)
+    unshown = IntegerField(default=0)
+    started = DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.user}"
+
+
+class UserDeck(models.Model):
+    """
+    A topic the user is learning, with the learning matrix totals of that topic.
+    """
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='decks')
+    deck = models.ForeignKey('Deck', on_delete=models.CASCADE, related_name='users')
+    cards = IntegerField(default=0)
+    learned = IntegerField(default=0)
+    unshown = IntegerField(default=0)
 
     class Meta:
-        indexes = [
-            models.Index(fields=['user', 'card']),
-        ]
+        unique_together = [['user', 'deck']]
 
     def __str__(self):
-        return f"{self.user} {self.question}"
+        return f"{self.user} {self.deck}"
@@ -0,0 +1,132 @@
+import cProfile
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import List, Optional
+
+from botbuilder.schema import Activity
+
+logger = getLogger(__name__)
+
+CAPTURE_NAME = re.compile(r"^[\w-]+$")
+
+
+class TurnProfiler:
+    """
+    Profiles one in `sample_rate` turns with cProfile and keeps the newest `keep` captures in `directory`:
+    a .prof file for pstats or snakeviz, and a .json file with the turn's wall time, activity type and the
+    dialog stack it arrived at. A sample rate of 0 turns profiling off.
+
+    cProfile follows the thread it is enabled on, so a capture also contains other turns that ran on the
+    event loop meanwhile, and queries that ran on the database threads show up as time spent waiting.
+    Only one turn is profiled at a time; a turn sampled while another is being profiled is skipped.
+    """
+
+    def __init__(self, sample_rate: int, directory: str, keep: int = 100):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self.turns = 0
+        self.skipped = 0
+        self._profiling = False
+
+    def sample(self) -> bool:
+        if self.sample_rate <= 0:
+            return False
+        self.turns += 1
+        if self.turns % self.sample_rate:
+            return False
+        if self._profiling:
+            self.skipped += 1
+            return False
+        return True
+
+    @contextmanager
+    def profile(self, activity: Activity, dialog_stack: List[str]):
+        profile = cProfile.Profile()
+        started = datetime.now(timezone.utc)
+        error = None
+        self._profiling = True
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        except Exception as turn_error:
+            error = repr(turn_error)
+            raise
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            self._profiling = False
+            try:
+                self._save(profile, {
+                    'started': started.isoformat(),
+                    'seconds': seconds,
+                    'activity_type': activity.type,
+                    'channel_id': activity.channel_id,
+                    'dialog_stack': dialog_stack,
+                    'error': error,
+                })
+            except OSError:
+                logger.exception('could not save the profile of a turn in %s', self.directory)
+
+    def _save(self, profile: cProfile.Profile, capture: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # sorts by time, and processes sharing the directory do not overwrite each other
+        name = f"{capture['started'][:26].replace(':', '').replace('.', '-')}-{os.getpid()}"
+        capture['name'] = name
+        profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+        with open(os.path.join(self.directory, f"{name}.json"), "w") as file:
+            json.dump(capture, file)
+        for old in self._names()[:-self.keep]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, old + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _names(self) -> List[str]:
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(file[:-len(".json")] for file in files if file.endswith(".json"))
+
+    def captures(self) -> List[dict]:
+        """
+        Metadata of the kept captures, slowest turn first.
+        """
+        captures = []
+        for name in self._names():
+            try:
+                with open(os.path.join(self.directory, f"{name}.json")) as file:
+                    captures.append(json.load(file))
+            except (OSError, ValueError):
+                # rotated away by another process, or still being written
+                continue
+        return sorted(captures, key=lambda capture: capture['seconds'], reverse=True)
+
+    def path(self, name: str) -> Optional[str]:
+        """
+        The .prof file of a kept capture, or None for names that are not one.
+        """
+        if not CAPTURE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, f"{name}.prof")
+        return path if os.path.isfile(path) else None
+
+
+def dialog_ids(dialog_state) -> List[str]:
+    """
+    Ids of the active dialog and, for component dialogs, of the active dialog inside it, outermost first.
+    """
+    ids = []
+    while dialog_state is not None and dialog_state.dialog_stack:
+        active = dialog_state.dialog_stack[0]
+        ids.append(active.id)
+        dialog_state = (active.state or {}).get("dialogs")
+    return ids
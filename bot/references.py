@@ -0,0 +1,85 @@
+import json
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity, ConversationReference
+
+from bot.db import db_call
+from bot.models import ConversationReferenceItem
+
+
+class ConversationReferenceStore:
+    """
+    Conversation references of users, the address proactive messages are sent to. They are stored in the
+    database, so they survive restarts and every worker process can remind every user. The references of
+    the `max_size` users seen last are also kept in memory; as a reference rarely changes between messages
+    of a user, a message only costs a database write when it does, and a read when the user is not in memory.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # user id -> (serialized document, reference), in least recently used order
+        self._entries: OrderedDict = OrderedDict()
+        self.writes = 0
+
+    async def add(self, activity: Activity):
+        """
+        Remembers the reference of the activity's conversation for its sender.
+        """
+        reference = TurnContext.get_conversation_reference(activity)
+        # the id of the message differs every time, and a proactive message does not reply to one
+        reference.activity_id = None
+        user_id = reference.user.id
+        document = json.dumps(reference.serialize(), sort_keys=True)
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != document:
+            if await self._save(user_id, reference.channel_id, document):
+                self.writes += 1
+        self._remember(user_id, document, reference)
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, ConversationReference]:
+        """
+        References of those of the users that have one.
+        """
+        references = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                missing.append(user_id)
+            else:
+                references[user_id] = entry[1]
+        if missing:
+            for user_id, document, reference in await self._load(missing):
+                self._remember(user_id, document, reference)
+                references[user_id] = reference
+        return references
+
+    def _remember(self, user_id: str, document: str, reference: ConversationReference):
+        self._entries[user_id] = (document, reference)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @db_call
+    def _load(self, user_ids: List[str]) -> List[Tuple[str, str, ConversationReference]]:
+        items = ConversationReferenceItem.objects.filter(user_id__in=user_ids).values_list('user_id', 'document')
+        return [(user_id, document, ConversationReference.deserialize(json.loads(document)))
+                for user_id, document in items]
+
+    @db_call
+    def _save(self, user_id: str, channel_id: str, document: str) -> bool:
+        """
+        Stores the document unless the database already has it, and tells whether it wrote.
+        """
+        item, created = ConversationReferenceItem.objects.get_or_create(
+            user_id=user_id, defaults={'channel_id': channel_id, 'document': document})
+        if created:
+            return True
+        if item.document == document:
+            return False
+        item.channel_id = channel_id
+        item.document = document
+        item.save(update_fields=['channel_id', 'document', 'updated'])
+        return True
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from datetime import datetime
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Tuple
+
+from botbuilder.core import BotFrameworkAdapter, MessageFactory, TurnContext
+from botbuilder.schema import ConversationReference
+from botframework.connector.auth import ClaimsIdentity
+from django.db.models import Count
+
+from bot.db import db_call
+from bot.models import LearningMatrix
+from bot.references import ConversationReferenceStore
+
+logger = getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket: on average `rate` acquisitions per second, at most `burst` at once.
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReminderRun:
+    """
+    Counters of one ReminderScheduler.run, so a run never reports messages sent by another one.
+    """
+
+    def __init__(self):
+        self.due_users = 0
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def stats(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            'due_users': self.due_users,
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'seconds': elapsed,
+            'sent_per_second': self.sent / elapsed if elapsed else 0.0,
+        }
+
+
+class ReminderScheduler:
+    """
+    Tells every user with due cards how many cards wait for review. Users are read from the learning matrix
+    in batches of `batch_size`, at most `concurrency` messages are in flight and each channel gets at most
+    `channel_rates[channel]` (or `default_rate`) messages per second, e.g. Telegram allows about 30.
+    Users without a stored conversation reference are skipped, the bot cannot start a conversation on its own.
+    One run happens at a time: run() called while another is in progress reminds nobody and returns the
+    progress of that run with `already_running` set.
+    """
+
+    def __init__(self, adapter: BotFrameworkAdapter, references: ConversationReferenceStore, app_id: str = None,
+                 concurrency: int = 10, batch_size: int = 500, default_rate: float = 25,
+                 channel_rates: Dict[str, float] = None, on_progress: Callable[[dict], None] = None):
+        self.adapter = adapter
+        self.references = references
+        self.app_id = app_id
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.default_rate = default_rate
+        self.channel_rates = channel_rates or {}
+        self.on_progress = on_progress
+        self._limiters: Dict[str, RateLimiter] = {}
+        self.current: Optional[ReminderRun] = None
+
+    async def run(self, now: datetime = None) -> dict:
+        if self.current is not None:
+            logger.info('reminders are already being sent, not starting another run')
+            return {**self.current.stats(), 'already_running': True}
+        run = self.current = ReminderRun()
+        try:
+            now = now or datetime.now().astimezone()
+            slots = asyncio.Semaphore(self.concurrency)
+            after = ""
+            while True:
+                batch = await self.due_batch(now, after)
+                if not batch:
+                    break
+                after = batch[-1][0]
+                run.due_users += len(batch)
+                references = await self.references.get_many([user_id for user_id, _ in batch])
+                await asyncio.gather(*(self.remind(run, user_id, due, references.get(user_id), slots)
+                                       for user_id, due in batch))
+                self.report(run)
+            run.finished = time.monotonic()
+            self.report(run)
+            return run.stats()
+        finally:
+            self.current = None
+
+    @db_call
+    def due_batch(self, now: datetime, after: str) -> List[Tuple[str, int]]:
+        # keyset pagination over user ids, so every batch is an index range scan
+        due = LearningMatrix.objects.filter(show_after__lte=now, user_id__gt=after) \
+            .values('user_id').annotate(due=Count('id')).order_by('user_id')
+        return [(row['user_id'], row['due']) for row in due[:self.batch_size]]
+
+    async def remind(self, run: ReminderRun, user_id: str, due: int, reference: ConversationReference,
+                     slots: asyncio.Semaphore):
+        if reference is None:
+            run.skipped += 1
+            return
+        async with slots:
+            await self.limiter(reference.channel_id).acquire()
+            try:
+                await self.adapter.continue_conversation(
+                    reference, lambda turn_context: self.send_reminder(turn_context, due), **self.identity())
+                run.sent += 1
+            except Exception:
+                run.failed += 1
+                logger.exception('reminder to user=%s failed', user_id)
+
+    async def send_reminder(self, turn_context: TurnContext, due: int):
+        cards = "card" if due == 1 else "cards"
+        await turn_context.send_activity(MessageFactory.text(f"You have {due} {cards} to review. Send any message to start."))
+
+    def identity(self) -> dict:
+        if self.app_id:
+            return {'bot_id': self.app_id}
+        # local runs without an app id, e.g. the emulator and tests
+        return {'claims_identity': ClaimsIdentity({}, is_authenticated=False)}
+
+    def limiter(self, channel_id: str) -> RateLimiter:
+        if channel_id not in self._limiters:
+            self._limiters[channel_id] = RateLimiter(self.channel_rates.get(channel_id, self.default_rate))
+        return self._limiters[channel_id]
+
+    def report(self, run: ReminderRun):
+        stats = run.stats()
+        logger.info('reminders: %d due users, %d sent, %d skipped, %d failed, %.1f sent/sec',
+                    stats['due_users'], stats['sent'], stats['skipped'], stats['failed'], stats['sent_per_second'])
+        if self.on_progress:
+            self.on_progress(stats)
@@ -0,0 +1,124 @@
+from datetime import datetime
+from logging import getLogger
+from typing import Dict, Iterable
+
+from django.db import transaction
+
+from bot import stats
+from bot.models import LearningMatrix, ReviewEvent
+from bot.scheduling import SCHEDULER, Scheduler
+
+logger = getLogger(__name__)
+
+# Every review is appended to the ReviewEvent log with a single INSERT, and the learning matrix row it
+# belongs to is updated with one UPDATE, in the same transaction, so the log and its projection never
+# disagree. replay() recomputes the projection from the log, e.g. for a new schedule.
+# The row is read before the transaction and the UPDATE only applies if the row still has the values
+# read, otherwise it is read again: the transaction starts with a write, as on SQLite one that reads
+# first fails with "database is locked" when another one wrote meanwhile, while a write waits for the lock.
+
+REPLAY_CHUNK_SIZE = 1000
+PROJECTED_FIELDS = ['last_shown', 'show_after', 'show_count', 'easy_count', 'hard_count']
+
+
+def card_shown(user_id: str, card_id: int, when: datetime):
+    rows = LearningMatrix.objects.filter(user=user_id, card=card_id)
+    while True:
+        lmx = rows.values('id', 'deck_id', 'show_count').get()
+        with transaction.atomic():
+            if not rows.filter(show_count=lmx['show_count']).update(last_shown=when, show_count=lmx['show_count'] + 1):
+                # another turn reviewed the card since it was read
+                continue
+            ReviewEvent.objects.create(user_id=user_id, card_id=card_id, matrix_id=lmx['id'], kind=ReviewEvent.SHOWN,
+                                       created=when)
+            if lmx['show_count'] == 0:
+                stats.card_shown(user_id, lmx['deck_id'], when)
+            return
+
+
+def card_marked(user_id: str, card_id: int, easy: bool, when: datetime):
+    rows = LearningMatrix.objects.filter(user=user_id, card=card_id)
+    while True:
+        lmx = rows.values('id', 'deck_id', 'last_shown', 'easy_count', 'hard_count').get()
+        if easy:
+            # counted from when the card was shown, so bot.scheduling.reschedule() arrives at the same time
+            changes = {'easy_count': lmx['easy_count'] + 1, 'show_after': SCHEDULER.show_after(
+                lmx['last_shown'], lmx['easy_count'] + 1, lmx['hard_count'])}
+        else:
+            changes = {'hard_count': lmx['hard_count'] + 1}
+        with transaction.atomic():
+            if not rows.filter(last_shown=lmx['last_shown'], easy_count=lmx['easy_count'],
+                               hard_count=lmx['hard_count']).update(**changes):
+                # another turn reviewed the card since it was read
+                continue
+            ReviewEvent.objects.create(user_id=user_id, card_id=card_id, matrix_id=lmx['id'],
+                                       kind=ReviewEvent.EASY if easy else ReviewEvent.HARD, created=when)
+            if easy and lmx['easy_count'] == 0:
+                stats.card_learned(user_id, lmx['deck_id'])
+            return
+
+
+def replay(user_ids: Iterable[str] = None, scheduler: Scheduler = None,
+           chunk_size: int = REPLAY_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Recomputes the learning matrix rows of the given users, or of everyone, by applying their events in
+    order the way the dialogs do, with `scheduler` (SCHEDULER by default) for the show times. Rows are
+    processed `chunk_size` at a time in id order, their events are streamed from the database and only
+    rows that change are written back. User stats are recounted afterwards. Returns the number of rows
+    and events read and of rows updated.
+    """
+    scheduler = scheduler or SCHEDULER
+    rows = LearningMatrix.objects.order_by('id')
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        rows = rows.filter(user_id__in=user_ids)
+    read = events = updated = 0
+    after = 0
+    while True:
+        # the rows of a chunk are locked, so reviews that happen meanwhile wait instead of being overwritten
+        with transaction.atomic():
+            chunk = list(rows.select_for_update().filter(id__gt=after).only('id', *PROJECTED_FIELDS)[:chunk_size])
+            if not chunk:
+                break
+            after = chunk[-1].id
+            read += len(chunk)
+            projected = {lmx.id: _Projection(lmx) for lmx in chunk}
+            log = ReviewEvent.objects.filter(matrix_id__in=list(projected)).order_by('matrix_id', 'id') \
+                .values_list('matrix_id', 'kind', 'created')
+            for matrix_id, kind, created in log.iterator(chunk_size=chunk_size):
+                projected[matrix_id].apply(kind, created, scheduler)
+                events += 1
+            changed = [projection.row for projection in projected.values() if projection.changed()]
+            LearningMatrix.objects.bulk_update(changed, PROJECTED_FIELDS, batch_size=100)
+            updated += len(changed)
+        logger.info('replayed %d events of %d rows, %d changed', events, read, updated)
+    if updated:
+        stats.rebuild(user_ids)
+    return {'rows': read, 'events': events, 'updated': updated}
+
+
+class _Projection:
+    """
+    A learning matrix row folded from its events, starting from the state of a freshly enrolled card.
+    """
+
+    def __init__(self, row: LearningMatrix):
+        self.row = row
+        self.before = tuple(getattr(row, field) for field in PROJECTED_FIELDS)
+        # a new card is due at once and was never shown, see ChooseTopicDialog.add_cards_to_learning_matrix
+        row.last_shown = row.show_after = datetime.utcfromtimestamp(0).astimezone()
+        row.show_count = row.easy_count = row.hard_count = 0
+
+    def apply(self, kind: int, created: datetime, scheduler: Scheduler):
+        row = self.row
+        if kind == ReviewEvent.SHOWN:
+            row.last_shown = created
+            row.show_count += 1
+        elif kind == ReviewEvent.EASY:
+            row.easy_count += 1
+            row.show_after = scheduler.show_after(row.last_shown, row.easy_count, row.hard_count)
+        elif kind == ReviewEvent.HARD:
+            row.hard_count += 1
+
+    def changed(self) -> bool:
+        return tuple(getattr(self.row, field) for field in PROJECTED_FIELDS) != self.before
@@ -0,0 +1,125 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import Dict, Iterable, Type
+
+import numpy as np
+from django.db import transaction
+
+from bot.models import LearningMatrix
+
+logger = getLogger(__name__)
+
+RESCHEDULE_CHUNK_SIZE = 5000
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class Scheduler(ABC):
+    """
+    Spaced repetition schedule: how many days after a card was marked easy it is shown again, from the
+    card's easy and hard counts. Subclasses implement intervals() on arrays, so the same schedule serves
+    a single answer in the dialog and a recomputation of the whole learning matrix.
+    """
+
+    @abstractmethod
+    def intervals(self, easy_counts: np.ndarray, hard_counts: np.ndarray) -> np.ndarray:
+        pass
+
+    def interval(self, easy_count: int, hard_count: int) -> float:
+        return float(self.intervals(np.array([easy_count]), np.array([hard_count]))[0])
+
+    def show_after(self, marked: datetime, easy_count: int, hard_count: int) -> datetime:
+        return marked + timedelta(days=self.interval(easy_count, hard_count))
+
+
+class FixedIntervals(Scheduler):
+    """
+    The n-th easy answer shows the card again after days[n - 1] days, and after the last of them from then on.
+    """
+
+    def __init__(self, days: Iterable[float] = (1, 6, 9, 19)):
+        self.days = np.array(list(days), dtype=float)
+
+    def intervals(self, easy_counts, hard_counts):
+        return self.days[np.clip(easy_counts, 1, len(self.days)) - 1]
+
+
+class SM2Intervals(Scheduler):
+    """
+    SM-2 style growth: 1 day, then 6 days, then each interval is the previous one times the ease factor.
+    The ease factor starts at `ease` and every hard answer lowers it by `hard_penalty`, down to `min_ease`.
+    """
+
+    def __init__(self, ease: float = 2.5, hard_penalty: float = 0.15, min_ease: float = 1.3, max_days: float = 365):
+        self.ease = ease
+        self.hard_penalty = hard_penalty
+        self.min_ease = min_ease
+        self.max_days = max_days
+
+    def intervals(self, easy_counts, hard_counts):
+        ease = np.maximum(self.min_ease, self.ease - self.hard_penalty * hard_counts)
+        days = 6 * ease ** np.maximum(easy_counts - 2, 0)
+        return np.minimum(np.where(easy_counts <= 1, 1, days), self.max_days)
+
+
+SCHEDULERS: Dict[str, Type[Scheduler]] = {
+    'fixed': FixedIntervals,
+    'sm2': SM2Intervals,
+}
+
+# The schedule of InitialLearningDialog.mark_easy_hard. After changing it, run `manage.py reschedule`
+# to move the cards learned before onto the new schedule.
+SCHEDULER = SCHEDULERS[os.getenv("SCHEDULER", "fixed")]()
+
+
+def reschedule(scheduler: Scheduler = None, user_ids: Iterable[str] = None,
+               chunk_size: int = RESCHEDULE_CHUNK_SIZE) -> Dict[str, float]:
+    """
+    Recomputes show_after of every learned card as the time it was last shown plus the scheduler's
+    interval. Rows are read as columns `chunk_size` at a time in id order, the intervals of a chunk are
+    computed at once with NumPy, and only rows whose show_after changes are written back, with bulk
+    updates. Each chunk is read and written in one transaction that locks its rows, as reviews.replay does.
+    Returns the number of rows read and updated and the rows read per second.
+    """
+    scheduler = scheduler or SCHEDULER
+    rows = LearningMatrix.objects.filter(easy_count__gte=1).order_by('id')
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=list(user_ids))
+    start = time.perf_counter()
+    read = updated = 0
+    after = 0
+    while True:
+        # the rows of a chunk are locked, so reviews that happen meanwhile wait instead of being overwritten
+        with transaction.atomic():
+            chunk = list(rows.select_for_update().filter(id__gt=after).values_list(
+                'id', 'last_shown', 'show_after', 'easy_count', 'hard_count')[:chunk_size])
+            if not chunk:
+                break
+            after = chunk[-1][0]
+            read += len(chunk)
+            ids, last_shown, show_after, easy_counts, hard_counts = zip(*chunk)
+            # whole microseconds since the epoch, the resolution the database keeps
+            last_shown = np.array([_microseconds(value) for value in last_shown], dtype=np.int64)
+            show_after = np.array([_microseconds(value) for value in show_after], dtype=np.int64)
+            days = scheduler.intervals(np.array(easy_counts), np.array(hard_counts))
+            new_show_after = last_shown + np.round(days * SECONDS_PER_DAY * 1e6).astype(np.int64)
+            changed = np.flatnonzero(new_show_after != show_after)
+            if len(changed):
+                LearningMatrix.objects.bulk_update(
+                    [LearningMatrix(id=ids[i], show_after=_datetime(new_show_after[i])) for i in changed],
+                    ['show_after'], batch_size=500)
+                updated += len(changed)
+        logger.info('rescheduled %d rows, %d changed', read, updated)
+    elapsed = time.perf_counter() - start
+    return {'rows': read, 'updated': updated, 'seconds': elapsed, 'rows_per_second': read / elapsed if elapsed else 0.0}
+
+
+def _microseconds(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _datetime(microseconds) -> datetime:
+    return EPOCH + timedelta(microseconds=int(microseconds))
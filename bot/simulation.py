@@ -0,0 +1,147 @@
+import asyncio
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from random import Random
+from typing import List, Tuple
+
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount, ResourceResponse
+from django.db import connections
+
+from bot.models import Deck, Card, Question, Answer, LearningMatrix
+
+CHANNEL_ID = "simulation"
+SERVICE_URL = "http://localhost"
+
+
+class LocalAdapter(BotFrameworkAdapter):
+    """
+    BotFrameworkAdapter that keeps outbound activities in process instead of posting them to the channel.
+    Incoming activities still go through the regular pipeline, so it can stand in for ADAPTER in
+    benchmarks and tests. Authentication is disabled because no app id is configured. `latency` seconds
+    are awaited per send, a stand-in for the round trip to the channel.
+    """
+
+    def __init__(self, record: bool = False, latency: float = 0):
+        super(LocalAdapter, self).__init__(BotFrameworkAdapterSettings(None, None))
+        self.record = record
+        self.latency = latency
+        self.sent: List[Activity] = []
+        self.sent_count = 0
+        self._ids = count(1)
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        responses = []
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for activity in activities:
+            self.sent_count += 1
+            if self.record:
+                self.sent.append(activity)
+            responses.append(ResourceResponse(id=str(next(self._ids))))
+        return responses
+
+
+def message_activity(user_id: str, text: str, conversation_id: str = None) -> Activity:
+    return Activity(
+        type=ActivityTypes.message,
+        text=text,
+        channel_id=CHANNEL_ID,
+        service_url=SERVICE_URL,
+        from_property=ChannelAccount(id=user_id),
+        recipient=ChannelAccount(id="sashick"),
+        conversation=ConversationAccount(id=conversation_id or user_id),
+    )
+
+
+def learning_script(deck_title: str, cards: int) -> List[str]:
+    """
+    Messages a new user sends to pick a topic and go through every card of it once.
+    """
+    script = ["hi", deck_title, "yes"]
+    for _ in range(cards):
+        script += ["Show answer", "Easy"]
+    return script
+
+
+def review_script(next_deck_title: str, cards: int, due_cards: int) -> List[str]:
+    """
+    Messages of a user who finished a topic and has due cards: pick the next topic, learn its cards, then
+    answer a quiz question and mark the card easy for every due card.
+    """
+    return learning_script(next_deck_title, cards)[1:] + ["I don't know", "Easy"] * due_cards
+
+
+def journey_scripts(rng: Random, first_deck_title: str, second_deck_title: str, cards: int,
+                    hard_percent: float = 20) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Two sessions of a new user as (step, message) pairs. In the first the user learns the first topic,
+    marks about `hard_percent` of the cards hard, which brings them back at the end of the topic, and
+    opens the help menu and their stats at the last card. The second session, once the first topic's
+    cards are due (see make_cards_due), learns the second topic and then takes the quiz on the first one.
+    The step names group turn latencies in benchmarks.
+    """
+    def review(first_answer: str) -> List[Tuple[str, str]]:
+        hard = [rng.random() * 100 < hard_percent for _ in range(cards)]
+        steps = []
+        for is_hard in hard:
+            steps += [first_answer, ("hard", "Hard") if is_hard else ("easy", "Easy")]
+        # a hard card is due again right away and comes back after the others
+        for _ in range(sum(hard)):
+            steps += [first_answer, ("easy", "Easy")]
+        return steps
+
+    show_answer = ("show answer", "Show answer")
+    learning = [("start", "hi"), ("choose topic", first_deck_title), ("confirm", "yes")] + review(show_answer)
+    # at the last card, after the learning dialog moved on from card to card
+    last_card = 3 + 2 * (cards - 1)
+    learning[last_card:last_card] = [("help", "?"), ("stats", "My stats"), ("back to topic", "<< Back to topic")]
+    reviewing = [("choose topic", second_deck_title), ("confirm", "yes")] + [show_answer, ("easy", "Easy")] * cards \
+        + review(("quiz answer", "I don't know"))
+    return learning, reviewing
+
+
+def make_cards_due(user_id: str):
+    LearningMatrix.objects.filter(user_id=user_id).update(show_after=datetime.utcfromtimestamp(0).astimezone())
+
+
+def seed_content(decks: int = 3, cards: int = 10, questions: int = 2) -> List[Deck]:
+    created = []
+    for deck_number in range(decks):
+        deck = Deck.objects.create(title=f"Deck {deck_number}")
+        for card_number in range(cards):
+            card = Card.objects.create(deck=deck, front=f"Front {deck_number}.{card_number}",
+                                       back=f"Back {deck_number}.{card_number}")
+            for question_number in range(questions):
+                question = Question.objects.create(card=card, text=f"Question {card_number}.{question_number}")
+                Answer.objects.create(question=question, correct=True, text=card.back)
+        created.append(deck)
+    return created
+
+
+def percentile(values, percent: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+@contextmanager
+def benchmark_database(verbosity: int = 0):
+    """
+    Runs the block against a throwaway test database, so benchmarks never touch real learning progress.
+    SQLite gets a file instead of the usual in-memory database to allow access from several threads.
+    """
+    connection = connections["default"]
+    temp_dir = None
+    if connection.vendor == "sqlite":
+        temp_dir = tempfile.TemporaryDirectory()
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(temp_dir.name, "benchmark.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        if temp_dir:
+            temp_dir.cleanup()
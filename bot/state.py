@@ -1,5 +1,57 @@
-from botbuilder.core import ConversationState, UserState, MemoryStorage
+import os
+from typing import Optional, Tuple
 
-MEMORY = MemoryStorage()
-CONVERSATION_STATE = ConversationState(MEMORY)
-USER_STATE = UserState(MEMORY)
\ No newline at end of file
+from botbuilder.core import BotState, ConversationState, UserState, MemoryStorage, Storage, TurnContext
+from botbuilder.core.bot_state import CachedBotState
+
+from bot.storage import DjangoStorage
+
+# "database" keeps dialog stacks in the Django database, so they survive restarts and are shared by all
+# worker processes. "memory" keeps them in this process only.
+STORAGE = MemoryStorage() if os.getenv("STATE_STORAGE", "database") == "memory" else DjangoStorage()
+CONVERSATION_STATE = ConversationState(STORAGE)
+USER_STATE = UserState(STORAGE)
+
+
+class TurnStateManager:
+    """
+    Saves the bot states of a turn together at the end of the turn. Every state that changed during the
+    turn goes into one storage write instead of a serialize-and-write per state and per save_changes call.
+    Dialog code only changes state through property accessors and never saves it itself. `writes` counts
+    the storage writes of the `turns` saved, at most one per storage and turn.
+    """
+
+    def __init__(self, *states: BotState):
+        self.states = states
+        self.turns = 0
+        self.writes = 0
+
+    async def save_changes(self, turn_context: TurnContext):
+        changes_by_storage = {}
+        saved = []
+        for state in self.states:
+            storage, cached = cached_state(state, turn_context)
+            if cached is not None and cached.is_changed:
+                changes = changes_by_storage.setdefault(storage, {})
+                changes[state.get_storage_key(turn_context)] = cached.state
+                saved.append(cached)
+
+        for storage, changes in changes_by_storage.items():
+            await storage.write(changes)
+        for cached in saved:
+            cached.hash = cached.compute_hash(cached.state)
+
+        self.turns += 1
+        self.writes += len(changes_by_storage)
+
+    @property
+    def writes_per_turn(self) -> float:
+        return self.writes / self.turns if self.turns else 0.0
+
+
+def cached_state(state: BotState, turn_context: TurnContext) -> Tuple[Storage, Optional[CachedBotState]]:
+    """
+    The storage of a bot state and what the turn loaded of it, if anything. BotState has no public accessor
+    for either in botbuilder 4.9, this is the one place that reaches into its attributes.
+    """
+    return state._storage, turn_context.turn_state.get(state._context_service_key)
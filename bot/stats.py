@@ -0,0 +1,125 @@
+from datetime import datetime
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_delete
+
+from bot.models import Deck, LearningMatrix, UserStats, UserDeck
+
+# UserStats and UserDeck totals are updated in the same transaction as the learning matrix rows they
+# count, so "My stats" is a primary key read instead of counts over the whole matrix. The functions
+# below are called from the dialogs' database helpers, inside their transaction. Learning matrix rows
+# whose deck was deleted keep their history but belong to no topic, and are neither shown nor counted.
+
+# rows per INSERT when rebuilding, small enough for SQLite's limit of 999 parameters per statement
+REBUILD_BATCH_SIZE = 100
+
+
+def enrolled(user_id: str, deck_id: int) -> int:
+    """
+    Counts the cards of a topic the user was just enrolled in, and returns how many of them are new. The
+    rows are created empty if missing before anything is read, so on SQLite the transaction holds the write
+    lock from its first statement.
+    """
+    UserDeck.objects.bulk_create([UserDeck(user_id=user_id, deck_id=deck_id)], ignore_conflicts=True)
+    UserStats.objects.bulk_create([UserStats(user_id=user_id)], ignore_conflicts=True)
+    user_deck = UserDeck.objects.select_for_update().get(user_id=user_id, deck_id=deck_id)
+    totals = _deck_totals(LearningMatrix.objects.filter(user_id=user_id, deck_id=deck_id))
+    delta = {field: totals[field] - getattr(user_deck, field) for field in totals}
+    UserDeck.objects.filter(pk=user_deck.pk).update(**totals)
+    UserStats.objects.filter(user_id=user_id).update(**{field: F(field) + delta[field] for field in delta})
+    return delta['cards']
+
+
+def card_shown(user_id: str, deck_id: int, when: datetime):
+    """
+    A card was shown to the user for the first time.
+    """
+    if deck_id is None:
+        return
+    UserDeck.objects.filter(user_id=user_id, deck_id=deck_id).update(unshown=F('unshown') - 1)
+    UserStats.objects.filter(user_id=user_id).update(unshown=F('unshown') - 1, started=Coalesce('started', Value(when)))
+
+
+def card_learned(user_id: str, deck_id: int):
+    """
+    The user marked a card easy for the first time.
+    """
+    if deck_id is None:
+        return
+    UserDeck.objects.filter(user_id=user_id, deck_id=deck_id).update(learned=F('learned') + 1)
+    UserStats.objects.filter(user_id=user_id).update(learned=F('learned') + 1)
+
+
+def dropped(user_id: str, deck_id: int):
+    """
+    The user dropped a topic, its cards no longer count.
+    """
+    user_deck = UserDeck.objects.filter(user_id=user_id, deck_id=deck_id).first()
+    if user_deck is None:
+        return
+    UserStats.objects.filter(user_id=user_id).update(
+        cards=F('cards') - user_deck.cards,
+        learned=F('learned') - user_deck.learned,
+        unshown=F('unshown') - user_deck.unshown)
+    user_deck.delete()
+
+
+def deck_deleted(sender, instance: Deck, **kwargs):
+    """
+    A deck is being deleted: its cards no longer count for anyone learning it. Connected to Deck's
+    pre_delete signal, the UserDeck rows are then deleted with the deck.
+    """
+    user_decks = UserDeck.objects.filter(deck_id=instance.pk)
+    deck_totals = user_decks.filter(user_id=OuterRef('user_id'))
+    UserStats.objects.filter(user_id__in=user_decks.values('user_id')).update(
+        **{field: F(field) - Subquery(deck_totals.values(field)[:1]) for field in ('cards', 'learned', 'unshown')})
+
+
+pre_delete.connect(deck_deleted, sender=Deck, dispatch_uid="stats-deck-deleted")
+
+
+def rebuild(user_ids: Iterable[str] = None) -> int:
+    """
+    Recounts the stats of the given users, or of everyone, from the learning matrix. Returns the number
+    of users recounted.
+    """
+    matrix = LearningMatrix.objects.filter(deck__isnull=False)
+    user_stats = UserStats.objects.all()
+    user_decks = UserDeck.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        matrix = matrix.filter(user_id__in=user_ids)
+        user_stats = user_stats.filter(user_id__in=user_ids)
+        user_decks = user_decks.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        # the first show of a card is not kept in the matrix, keep the recorded one
+        started = dict(user_stats.filter(started__isnull=False).values_list('user_id', 'started'))
+        user_stats.delete()
+        user_decks.delete()
+
+        UserDeck.objects.bulk_create(
+            (UserDeck(**row) for row in _deck_totals(
+                matrix.values('user_id', 'deck_id').order_by(), aggregate=False)),
+            batch_size=REBUILD_BATCH_SIZE)
+
+        users = matrix.values('user_id').order_by().annotate(
+            first_shown=Min('last_shown', filter=Q(show_count__gt=0)))
+        rows = []
+        for row in _deck_totals(users, aggregate=False):
+            first_shown = row.pop('first_shown')
+            rows.append(UserStats(started=started.get(row['user_id'], first_shown), **row))
+        UserStats.objects.bulk_create(rows, batch_size=REBUILD_BATCH_SIZE)
+    return len(rows)
+
+
+def _deck_totals(matrix, aggregate=True):
+    totals = {
+        'cards': Count('id'),
+        'learned': Count('id', filter=Q(easy_count__gt=0)),
+        'unshown': Count('id', filter=Q(show_count=0)),
+    }
+    return matrix.aggregate(**totals) if aggregate else matrix.annotate(**totals)
@@ -0,0 +1,109 @@
+import json
+import uuid
+from typing import Dict, List
+
+from botbuilder.core import Storage, StoreItem
+from django.db import IntegrityError, transaction
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler
+
+from bot.db import db_call
+from bot.metrics import state_round_trip
+from bot.models import StateItem
+
+
+class ETagConflict(KeyError):
+    """
+    Another turn wrote a state document since it was read. A KeyError, as MemoryStorage raises on a conflict.
+    """
+
+
+class DjangoStorage(Storage):
+    """
+    Bot state storage on the Django database, so dialog stacks survive restarts and are shared between
+    worker processes. Documents are serialized with jsonpickle, the same way BotState hashes them.
+
+    Writes use optimistic concurrency: a document read with an e_tag is only written back if nobody else
+    wrote it in the meantime, otherwise ETagConflict is raised. An e_tag of "*" overwrites unconditionally.
+    All changes passed to one write() are stored in a single transaction, and their e_tags are only updated
+    once it committed.
+    """
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        if not keys:
+            return {}
+        with state_round_trip("read"):
+            return await self._read(keys)
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if changes:
+            with state_round_trip("write"):
+                await self._write(changes)
+
+    async def delete(self, keys: List[str]):
+        with state_round_trip("delete"):
+            await self._delete(keys)
+
+    @db_call
+    def _read(self, keys):
+        items = {}
+        for item in StateItem.objects.filter(key__in=keys):
+            value = Unpickler().restore(json.loads(item.document))
+            set_e_tag(value, item.e_tag)
+            items[item.key] = value
+        return items
+
+    @db_call
+    def _write(self, changes):
+        new_e_tags = {}
+        with transaction.atomic():
+            for key, change in changes.items():
+                e_tag = get_e_tag(change)
+                new_e_tag = uuid.uuid4().hex
+                document = json.dumps(Pickler().flatten(without_e_tag(change)))
+
+                if e_tag == "":
+                    raise Exception("DjangoStorage.write(): etag missing")
+                if e_tag is None:
+                    # never read from storage, so this must be a new document
+                    try:
+                        with transaction.atomic():
+                            StateItem.objects.create(key=key, document=document, e_tag=new_e_tag)
+                    except IntegrityError:
+                        raise ETagConflict(f"Etag conflict. {key} was created by another turn")
+                else:
+                    items = StateItem.objects.filter(key=key)
+                    if e_tag != "*":
+                        items = items.filter(e_tag=e_tag)
+                    if not items.update(document=document, e_tag=new_e_tag):
+                        if e_tag != "*" and StateItem.objects.filter(key=key).exists():
+                            raise ETagConflict(f"Etag conflict. {key} was changed since e_tag {e_tag}")
+                        StateItem.objects.create(key=key, document=document, e_tag=new_e_tag)
+                new_e_tags[key] = new_e_tag
+        for key, new_e_tag in new_e_tags.items():
+            set_e_tag(changes[key], new_e_tag)
+
+    @db_call
+    def _delete(self, keys):
+        StateItem.objects.filter(key__in=list(keys)).delete()
+
+
+def get_e_tag(item) -> str:
+    if isinstance(item, dict):
+        return item.get("e_tag")
+    return getattr(item, "e_tag", None)
+
+
+def set_e_tag(item, e_tag: str):
+    if isinstance(item, dict):
+        item["e_tag"] = e_tag
+    else:
+        item.e_tag = e_tag
+
+
+def without_e_tag(item):
+    if isinstance(item, dict):
+        return {key: value for key, value in item.items() if key != "e_tag"}
+    return item
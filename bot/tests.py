@@ -1,3 +1,759 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+from datetime import datetime, timedelta
+import random
+import re
+import tempfile
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, ConversationState, InvokeResponse, \
+    MemoryStorage, TurnContext
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.dialogs import DialogSet
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from bot import content, reviews, stats
+from bot.answers import AnswerIndex
+from bot.asgi import BotMessagesApp
+from bot.bot import BOT, on_error
+from bot.content import CONTENT, ContentCache
+from bot.db import DB, DatabaseExecutor, default_workers
+from bot.dialog.cancel_and_help_dialog import CancelAndHelpDialog
+from bot.dialog.choose_topic_dialog import ChooseTopicDialog
+from bot.dialog.initial_learning import InitialLearningDialog
+from bot.dialog.quiz import QuizDialog
+from bot.dispatcher import ConversationDispatcher
+from bot.metrics import TURN, BotMetrics, MeteredAdapter, MeteredWaterfallDialog
+from bot.profiling import TurnProfiler
+from bot.models import Card, ConversationReferenceItem, Deck, LearningMatrix, Question, ReviewEvent, User, UserDeck, \
+    UserStats
+from bot.references import ConversationReferenceStore
+from bot.scheduling import FixedIntervals, SM2Intervals, reschedule
+from bot.reminders import ReminderScheduler
+from bot.simulation import LocalAdapter, journey_scripts, learning_script, make_cards_due, message_activity, \
+    seed_content
+from bot.state import CONVERSATION_STATE
+from bot.storage import DjangoStorage, ETagConflict
+from bot.turn_pool import TurnWorkerPool
+from bot.users import UserActivity
+
+
+def setUpModule():
+    # test data lives in the transaction of the main thread's connection
+    DB.thread_sensitive = True
+
+
+class ConversationDispatcherTest(SimpleTestCase):
+    def test_interleaved_turns_keep_order_per_conversation(self):
+        dispatcher = ConversationDispatcher()
+        conversations = [f"conversation-{n}" for n in range(50)]
+        started = {conversation: [] for conversation in conversations}
+        running = {conversation: 0 for conversation in conversations}
+        overlaps = []
+        peak = [0]
+
+        async def turn(conversation, number):
+            running[conversation] += 1
+            overlaps.append(running[conversation] > 1)
+            peak[0] = max(peak[0], sum(running.values()))
+            started[conversation].append(number)
+            await asyncio.sleep(random.random() / 1000)
+            running[conversation] -= 1
+
+        async def fire():
+            turns = []
+            for number in range(20):
+                for conversation in random.sample(conversations, len(conversations)):
+                    turns.append(dispatcher.run(conversation, lambda c=conversation, n=number: turn(c, n)))
+            await asyncio.gather(*turns)
+
+        async_to_sync(fire)()
+
+        for conversation in conversations:
+            self.assertEqual(started[conversation], list(range(20)))
+        self.assertFalse(any(overlaps))
+        self.assertGreater(peak[0], 1)
+        self.assertEqual(dispatcher.active_conversations, 0)
+
+
+class TurnOrderingStressTest(TestCase):
+    def test_quick_taps_do_not_overwrite_dialog_state(self):
+        deck = seed_content(decks=1, cards=3, questions=0)[0]
+        script = learning_script(deck.title, 3)
+        users = [f"stress-{uuid.uuid4()}" for _ in range(20)]
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        pool = TurnWorkerPool(workers=8, max_queue=len(users) * len(script))
+
+        async def fire():
+            # every message of every user is submitted before the first turn finishes
+            for text in script:
+                for user_id in random.sample(users, len(users)):
+                    activity = message_activity(user_id, text)
+                    self.assertTrue(pool.submit(
+                        lambda a=activity: adapter.process_activity(a, "", BOT.on_turn), user_id))
+            await pool.drain()
+
+        async_to_sync(fire)()
+
+        self.assertEqual(pool.failed, 0)
+        for user_id in users:
+            rows = LearningMatrix.objects.filter(user_id=user_id)
+            self.assertEqual(rows.count(), 3)
+            self.assertEqual(rows.filter(easy_count=1, show_count=1).count(), 3)
+
+
+class DjangoStorageTest(TestCase):
+    def test_write_checks_e_tag(self):
+        storage = DjangoStorage()
+        async_to_sync(storage.write)({"conversation": {"welcomed": True}})
+
+        first = async_to_sync(storage.read)(["conversation"])["conversation"]
+        second = async_to_sync(storage.read)(["conversation"])["conversation"]
+        self.assertEqual(first["welcomed"], True)
+
+        first["welcomed"] = False
+        async_to_sync(storage.write)({"conversation": first})
+        second["welcomed"] = None
+        with self.assertRaises(ETagConflict):
+            async_to_sync(storage.write)({"conversation": second})
+
+        second["e_tag"] = "*"
+        async_to_sync(storage.write)({"conversation": second})
+        self.assertIsNone(async_to_sync(storage.read)(["conversation"])["conversation"]["welcomed"])
+
+    def test_failed_write_keeps_e_tags(self):
+        storage = DjangoStorage()
+        async_to_sync(storage.write)({"conversation": {"step": 1}, "user": {"name": "a"}})
+        read = async_to_sync(storage.read)(["conversation", "user"])
+        conversation, user = read["conversation"], read["user"]
+        e_tag = conversation["e_tag"]
+        async_to_sync(storage.write)({"user": dict(user)})
+
+        # the conversation is written before the stale user fails, and rolled back with it
+        conversation["step"] = 2
+        with self.assertRaises(ETagConflict):
+            async_to_sync(storage.write)({"conversation": conversation, "user": user})
+        self.assertEqual(conversation["e_tag"], e_tag)
+        async_to_sync(storage.write)({"conversation": conversation})
+        self.assertEqual(async_to_sync(storage.read)(["conversation"])["conversation"]["step"], 2)
+
+    def test_conflicts_keep_the_conversation_state(self):
+        adapter = TestAdapter()
+        context = TurnContext(adapter, message_activity("conflict", "hi"))
+        with mock.patch.object(CONVERSATION_STATE, "delete") as delete:
+            async_to_sync(on_error)(context, ETagConflict("Etag conflict"))
+            delete.assert_not_called()
+            async_to_sync(on_error)(context, ValueError("bug"))
+            delete.assert_called_once()
+
+
+class TurnStateManagerTest(TestCase):
+    def test_state_is_written_once_per_turn(self):
+        deck = seed_content(decks=1, cards=2, questions=0)[0]
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        user_id = f"writes-{uuid.uuid4()}"
+
+        manager = BOT.state_manager
+        for text in learning_script(deck.title, 2):
+            turns, writes = manager.turns, manager.writes
+            async_to_sync(adapter.process_activity)(message_activity(user_id, text), "", BOT.on_turn)
+            self.assertEqual(manager.turns - turns, 1, text)
+            # conversation and user state share the storage, and every turn moves the dialog on
+            self.assertEqual(manager.writes - writes, 1, text)
+        self.assertLessEqual(manager.writes_per_turn, 1)
+
+
+class QuizQueryBudgetTest(TestCase):
+    def test_show_question_step(self):
+        card = seed_content(decks=1, cards=1, questions=2)[0].cards.get()
+        dialogs = DialogSet(ConversationState(MemoryStorage()).create_property("DialogState"))
+        dialogs.add(QuizDialog())
+
+        async def begin_quiz(turn_context):
+            dialog_context = await dialogs.create_context(turn_context)
+            await dialog_context.begin_dialog(QuizDialog.__name__, card.id)
+
+        adapter = TestAdapter(begin_quiz)
+        user = User.objects.create(user_id=adapter.template.from_property.id)
+        never = datetime.utcfromtimestamp(0).astimezone()
+        LearningMatrix.objects.create(user=user, card=card, deck=card.deck, last_shown=never, show_after=never,
+                                      show_count=0, easy_count=0, hard_count=0)
+        # next question after the cursor with its answers, then moving the cursor
+        asked = []
+        for _ in range(2):
+            with self.assertNumQueries(3):
+                async_to_sync(adapter.send)("quiz")
+            asked.append(LearningMatrix.objects.get(user=user).question_cursor)
+        # every question was shown: one more query to start over
+        with self.assertNumQueries(4):
+            async_to_sync(adapter.send)("quiz")
+        asked.append(LearningMatrix.objects.get(user=user).question_cursor)
+        first, second = card.questions.order_by('id').values_list('id', flat=True)
+        self.assertEqual(asked, [first, second, first])
+
+
+class EnrollmentTest(TestCase):
+    def test_deck_is_enrolled_in_batches(self):
+        deck = seed_content(decks=1, cards=7, questions=0)[0]
+        User.objects.create(user_id="enroll")
+        dialog = ChooseTopicDialog()
+
+        with mock.patch("bot.dialog.choose_topic_dialog.ENROLL_BATCH_SIZE", 3):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(async_to_sync(dialog.add_cards_to_learning_matrix)(deck.id, "enroll"), 7)
+            # three inserts for 7 cards
+            inserts = [query for query in queries if 'INTO "bot_learningmatrix"' in query['sql']]
+            self.assertEqual(len(inserts), 3)
+            # a repeated confirmation does not add the cards twice
+            self.assertEqual(async_to_sync(dialog.add_cards_to_learning_matrix)(deck.id, "enroll"), 0)
+
+        self.assertEqual(LearningMatrix.objects.filter(user="enroll").count(), 7)
+        with self.assertNumQueries(1):
+            self.assertEqual(async_to_sync(dialog.cards_count)(deck.id), 7)
+
+
+class ConcurrentEnrollmentTest(TransactionTestCase):
+    def test_users_enroll_at_the_same_time(self):
+        deck = seed_content(decks=1, cards=20, questions=0)[0]
+        user_ids = [f"concurrent-{n}" for n in range(8)]
+        User.objects.bulk_create(User(user_id=user_id) for user_id in user_ids)
+        dialog = ChooseTopicDialog()
+        executor = DatabaseExecutor(len(user_ids))
+
+        async def enroll_everyone():
+            # the first user confirms twice, like a double tap
+            with mock.patch("bot.db.DB", executor):
+                await asyncio.gather(*(dialog.add_cards_to_learning_matrix(deck.id, user_id)
+                                       for user_id in user_ids + user_ids[:1]))
+
+        try:
+            async_to_sync(enroll_everyone)()
+        finally:
+            executor._executor.shutdown()
+        self.assertEqual(executor.stats()['failed'], 0)
+        self.assertEqual(LearningMatrix.objects.count(), 20 * len(user_ids))
+        self.assertEqual(sorted(UserStats.objects.values_list('cards', flat=True)), [20] * len(user_ids))
+        self.assertEqual(UserDeck.objects.filter(cards=20, unshown=20).count(), len(user_ids))
+
+
+class DatabaseExecutorTest(TransactionTestCase):
+    def test_sqlite_runs_queries_on_one_thread_by_default(self):
+        self.assertEqual(default_workers(), 0)
+        self.assertTrue(DatabaseExecutor(0, thread_sensitive=True).thread_sensitive)
+        with self.assertRaises(ValueError):
+            DatabaseExecutor(0)
+
+    def calls(self, max_age, *funcs):
+        # a connection keeps the CONN_MAX_AGE it was opened with, so every setting gets fresh workers
+        executor = DatabaseExecutor(1)
+
+        async def run():
+            return [await executor.run(func) for func in funcs]
+
+        try:
+            with mock.patch.dict(connections['default'].settings_dict, {'CONN_MAX_AGE': max_age}):
+                return async_to_sync(run)()
+        finally:
+            executor._executor.shutdown()
+            self.assertEqual(executor.stats()['failed'], 0)
+
+    def test_workers_replace_old_and_broken_connections(self):
+        def raw_connection():
+            connections['default'].ensure_connection()
+            return connections['default'].connection
+
+        def drop_connection():
+            # the way a database server restart leaves it
+            raw_connection().close()
+
+        first, second = self.calls(None, raw_connection, raw_connection)
+        self.assertIs(first, second)
+
+        first, _, users, second = self.calls(
+            0, raw_connection, drop_connection, lambda: User.objects.count(), raw_connection)
+        self.assertEqual(users, 0)
+        self.assertIsNot(first, second)
+
+
+class UserActivityTest(TestCase):
+    def test_interaction_times_are_buffered(self):
+        user_activity = UserActivity(flush_seconds=3600)
+        with self.assertNumQueries(8):
+            # a new user is looked up and created in a savepoint, known users cost nothing
+            for _ in range(3):
+                async_to_sync(user_activity.touch)("activity-1")
+            async_to_sync(user_activity.touch)("activity-2")
+        with self.assertNumQueries(1):
+            async_to_sync(user_activity.flush)()
+        self.assertEqual(user_activity.flushed_users, 2)
+
+        User.objects.get(user_id="activity-1").delete()
+        async_to_sync(user_activity.touch)("activity-1")
+        self.assertTrue(User.objects.filter(user_id="activity-1").exists())
+
+
+class UserStatsTest(TestCase):
+    def test_stats_follow_the_learning_matrix(self):
+        first, second = seed_content(decks=2, cards=3, questions=0)
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        user_id = f"stats-{uuid.uuid4()}"
+        # learn the first topic, enroll in the second and see one of its cards
+        for text in learning_script(first.title, 3) + [second.title, "yes"]:
+            async_to_sync(adapter.process_activity)(message_activity(user_id, text), "", BOT.on_turn)
+
+        dialog = CancelAndHelpDialog(CancelAndHelpDialog.__name__)
+        with self.assertNumQueries(1):
+            statistics = async_to_sync(dialog.get_statistics)(user_id)
+        self.assertEqual((statistics['cards'], statistics['already_learned'], statistics['started']), (6, 50, 'today'))
+        self.assertEqual(async_to_sync(dialog.collect_user_decks)(user_id), [first.title, second.title])
+
+        def snapshot():
+            return (list(UserStats.objects.filter(user_id=user_id).values()),
+                    list(UserDeck.objects.filter(user_id=user_id).order_by('deck_id').values(
+                        'deck_id', 'cards', 'learned', 'unshown')))
+
+        incremental = snapshot()
+        self.assertEqual(stats.rebuild([user_id]), 1)
+        self.assertEqual(snapshot(), incremental)
+
+        async_to_sync(dialog.drop_topic)(user_id, second.cards.first())
+        self.assertEqual(UserStats.objects.values_list('cards', 'learned', 'unshown').get(user_id=user_id), (3, 3, 0))
+        self.assertEqual(async_to_sync(dialog.collect_user_decks)(user_id), [first.title])
+
+    def test_deleted_decks_keep_their_history_but_no_longer_count(self):
+        first, second = seed_content(decks=2, cards=3, questions=0)
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        user_id = f"deleted-{uuid.uuid4()}"
+        for text in learning_script(first.title, 3) + [second.title, "yes"]:
+            async_to_sync(adapter.process_activity)(message_activity(user_id, text), "", BOT.on_turn)
+
+        Deck.objects.filter(pk=second.pk).delete()
+        self.assertEqual(LearningMatrix.objects.filter(user_id=user_id, deck__isnull=True).count(), 3)
+        counted = UserStats.objects.values_list('cards', 'learned', 'unshown').get(user_id=user_id)
+        self.assertEqual(counted, (3, 3, 0))
+        stats.rebuild([user_id])
+        self.assertEqual(UserStats.objects.values_list('cards', 'learned', 'unshown').get(user_id=user_id), counted)
+        make_cards_due(user_id)
+        self.assertEqual(async_to_sync(InitialLearningDialog().card_to_show)(user_id).deck_id, first.id)
+
+
+class ContentCacheTest(TestCase):
+    def test_cards_are_cached_until_content_changes(self):
+        card = seed_content(decks=1, cards=1, questions=0)[0].cards.get()
+        cache = ContentCache(max_size=1)
+        load = lambda: Card.objects.select_related('deck').get(pk=card.id)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get(card.id, load).back, card.back)
+            cache.get(card.id, load)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.get("other", lambda: None)
+        self.assertEqual(cache.evictions, 1)
+
+        # bot.content.CONTENT is invalidated by saves in the admin
+        version = CONTENT.version
+        self.assertEqual(content.card(card.id).back, card.back)
+        card.back = "changed"
+        card.save()
+        self.assertGreater(CONTENT.version, version)
+        with self.assertNumQueries(1):
+            self.assertEqual(content.card(card.id).back, "changed")
+
+
+class AnswerIndexTest(TestCase):
+    def test_answers_are_graded_without_queries(self):
+        question = seed_content(decks=1, cards=1, questions=1)[0].cards.get().questions.get()
+        question.answers.create(correct=True, text="Ｍitochondrion")
+        question.answers.create(correct=False, text="Nucleus")
+        question = Question.objects.select_related('card').prefetch_related('answers').get(pk=question.pk)
+        quiz = QuizDialog()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(quiz.check_answer("  mitochondrion ", question))
+            self.assertFalse(quiz.check_answer("nucleus", question))
+            self.assertFalse(quiz.check_answer("mitochondria", question))
+            self.assertTrue(AnswerIndex(question, typo_tolerance=1).is_correct("mitochondrin"))
+            self.assertFalse(AnswerIndex(question, typo_tolerance=1).is_correct("nucleas"))
+            self.assertFalse(quiz.correct_answer_is_different(question, question.card))
+
+
+class ReminderSchedulerTest(TestCase):
+    def test_users_with_due_cards_are_reminded_once(self):
+        deck = seed_content(decks=1, cards=3, questions=0)[0]
+        now = datetime.now().astimezone()
+        references = ConversationReferenceStore()
+        for n, due in enumerate((2, 0, 1, 3)):
+            user = User.objects.create(user_id=f"reminder-{n}")
+            LearningMatrix.objects.bulk_create([
+                LearningMatrix(user=user, card=card, deck=deck, last_shown=now, show_count=1, easy_count=1,
+                               hard_count=0, show_after=now - timedelta(hours=1) if i < due else now + timedelta(days=1))
+                for i, card in enumerate(deck.cards.order_by('id'))])
+            # the last user never talked to this process
+            if n < 3:
+                async_to_sync(references.add)(message_activity(user.user_id, ""))
+        adapter = LocalAdapter(record=True)
+        progress = []
+        scheduler = ReminderScheduler(adapter, references, concurrency=2, batch_size=1, on_progress=progress.append)
+
+        result = async_to_sync(scheduler.run)(now)
+
+        self.assertEqual((result['due_users'], result['sent'], result['skipped'], result['failed']), (3, 2, 1, 0))
+        self.assertEqual(sorted((activity.recipient.id, activity.text) for activity in adapter.sent), [
+            ("reminder-0", "You have 2 cards to review. Send any message to start."),
+            ("reminder-2", "You have 1 card to review. Send any message to start."),
+        ])
+        # one report per batch of due users and one at the end
+        self.assertEqual([report['due_users'] for report in progress], [1, 2, 3, 3])
+
+        async def overlapping_runs():
+            return await asyncio.gather(scheduler.run(now), scheduler.run(now))
+
+        # a second run while the first is in progress sends nothing and does not reset its counters
+        adapter.sent.clear()
+        first, second = async_to_sync(overlapping_runs)()
+        self.assertEqual((first['sent'], first['skipped']), (2, 1))
+        self.assertNotIn('already_running', first)
+        self.assertTrue(second['already_running'])
+        self.assertEqual(len(adapter.sent), 2)
+        self.assertIsNone(scheduler.current)
+
+
+class ConversationReferenceStoreTest(TestCase):
+    def test_references_are_written_when_they_change(self):
+        references = ConversationReferenceStore(max_size=1)
+        with self.assertNumQueries(4):
+            # a new user is looked up and created in a savepoint, the same reference again costs nothing
+            async_to_sync(references.add)(message_activity("reference-1", "hi"))
+            async_to_sync(references.add)(message_activity("reference-1", "again"))
+        async_to_sync(references.add)(message_activity("reference-2", "hi", conversation_id="chat-2"))
+        with self.assertNumQueries(1):
+            # a user the store forgot is read back and, being unchanged, not written
+            async_to_sync(references.add)(message_activity("reference-1", "hi"))
+        async_to_sync(references.add)(message_activity("reference-1", "hi", conversation_id="chat-1"))
+        self.assertEqual(references.writes, 3)
+
+        # another process reads them from the database
+        loaded = async_to_sync(ConversationReferenceStore().get_many)(["reference-1", "reference-2", "reference-3"])
+        self.assertEqual({user_id: reference.conversation.id for user_id, reference in loaded.items()},
+                         {"reference-1": "chat-1", "reference-2": "chat-2"})
+        self.assertEqual(ConversationReferenceItem.objects.count(), 2)
+
+    def test_message_ids_do_not_count_as_changes(self):
+        references = ConversationReferenceStore()
+        for n in range(3):
+            activity = message_activity("reference-ids", "hi")
+            activity.id = f"message-{n}"
+            async_to_sync(references.add)(activity)
+        self.assertEqual(references.writes, 1)
+        stored = async_to_sync(ConversationReferenceStore().get_many)(["reference-ids"])["reference-ids"]
+        self.assertIsNone(stored.activity_id)
+
+
+class RescheduleTest(TestCase):
+    def test_batch_schedule_matches_the_dialog(self):
+        deck = seed_content(decks=1, cards=3, questions=0)[0]
+        user = User.objects.create(user_id="reschedule-1")
+        now = datetime.now().astimezone()
+        cards = list(deck.cards.order_by('id'))
+        for card, easy_count in zip(cards, (0, 1, 5)):
+            LearningMatrix.objects.create(user=user, card=card, deck=deck, last_shown=now, show_after=now,
+                                          show_count=1, easy_count=easy_count, hard_count=2)
+        fixed = FixedIntervals()
+        self.assertEqual([fixed.interval(easy_count, 0) for easy_count in range(1, 6)], [1, 6, 9, 19, 19])
+
+        # cards that were never marked easy stay due
+        result = reschedule(fixed)
+        self.assertEqual((result['rows'], result['updated']), (2, 2))
+        self.assertEqual(dict(LearningMatrix.objects.values_list('easy_count', 'show_after')),
+                         {0: now, 1: now + timedelta(days=1), 5: now + timedelta(days=19)})
+
+        async_to_sync(InitialLearningDialog().mark_easy_hard)(cards[0].id, user.user_id, "Easy")
+        result = reschedule(fixed)
+        self.assertEqual((result['rows'], result['updated']), (3, 0))
+        result = reschedule(SM2Intervals())
+        self.assertEqual((result['rows'], result['updated']), (3, 1))
+
+
+class ReviewEventTest(TestCase):
+    def test_learning_matrix_is_a_projection_of_the_log(self):
+        deck = seed_content(decks=1, cards=3, questions=0)[0]
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        user_id = f"reviews-{uuid.uuid4()}"
+        for text in learning_script(deck.title, 3):
+            async_to_sync(adapter.process_activity)(message_activity(user_id, text), "", BOT.on_turn)
+        self.assertEqual(ReviewEvent.objects.filter(user_id=user_id, kind=ReviewEvent.SHOWN).count(), 3)
+
+        def snapshot():
+            return list(LearningMatrix.objects.filter(user_id=user_id).order_by('id').values(*reviews.PROJECTED_FIELDS))
+
+        projected = snapshot()
+        self.assertEqual(reviews.replay([user_id]), {'rows': 3, 'events': 6, 'updated': 0})
+        LearningMatrix.objects.filter(user_id=user_id).update(show_count=5, easy_count=0)
+        self.assertEqual(reviews.replay([user_id])['updated'], 3)
+        self.assertEqual(snapshot(), projected)
+
+
+class JourneyScriptTest(TestCase):
+    def test_simulated_user_finishes_both_sessions(self):
+        first, second = seed_content(decks=2, cards=3, questions=1)
+        adapter = LocalAdapter(record=True)
+        adapter.on_turn_error = on_error
+        user_id = f"journey-{uuid.uuid4()}"
+        learning, reviewing = journey_scripts(random.Random(3), first.title, second.title, 3, hard_percent=50)
+        for script, finished in ((learning, "Yay! You have learned all cards in this topic."),
+                                 (reviewing, "Yay! You have revised all cards in this topic.")):
+            for _, text in script:
+                async_to_sync(adapter.process_activity)(message_activity(user_id, text), "", BOT.on_turn)
+            self.assertIn(finished, [activity.text for activity in adapter.sent[-3:]])
+            make_cards_due(user_id)
+        self.assertNotIn("The bot encountered an error or bug.", [activity.text for activity in adapter.sent])
+
+
+class GenerateDatasetTest(TestCase):
+    def test_generated_matrix_matches_its_review_log(self):
+        call_command('generate_dataset', users=20, decks=3, cards=10, stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(user_id__startswith="generated-").count(), 20)
+        # topics are chosen by title, so every deck needs its own
+        self.assertEqual(len(set(Deck.objects.values_list('title', flat=True))), Deck.objects.count())
+        rows = LearningMatrix.objects.count()
+        self.assertEqual(reviews.replay(), {'rows': rows, 'events': ReviewEvent.objects.count(), 'updated': 0})
+
+
+class GenerateDatasetChunksTest(TransactionTestCase):
+    def test_every_chunk_commits_on_its_own(self):
+        # chunks this small end between any two rows, each is committed with its foreign keys checked
+        call_command('generate_dataset', users=5, decks=2, cards=3, chunk_size=7, stdout=io.StringIO())
+        self.assertEqual(UserStats.objects.count(), 5)
+        self.assertEqual(reviews.replay()['updated'], 0)
+
+
+class TurnMetricsTest(TestCase):
+    def test_turns_steps_and_round_trips_are_measured(self):
+        deck = seed_content(decks=1, cards=2, questions=0)[0]
+        metrics = BotMetrics()
+        adapter = MeteredAdapter(BotFrameworkAdapterSettings(None, None), metrics)
+        adapter.on_turn_error = on_error
+        user_id = f"metrics-{uuid.uuid4()}"
+        script = learning_script(deck.title, 2)
+        for text in script:
+            # replies come back in the response, so nothing is posted to a channel
+            activity = message_activity(user_id, text)
+            activity.delivery_mode = DeliveryModes.expect_replies
+            async_to_sync(adapter.process_activity)(activity, "", BOT.on_turn)
+
+        self.assertEqual(metrics.turn_seconds.count("message"), len(script))
+        self.assertEqual(metrics.step_seconds.count("InitialLearningDialog.show_card_step"), 2)
+        exposition = metrics.expose()
+        self.assertIn(f'bot_turn_db_queries_count{{activity_type="message"}} {len(script)}', exposition)
+        self.assertIn('bot_state_seconds_count{operation="write"}', exposition)
+        queries = re.search(r'bot_turn_db_queries_sum{activity_type="message"} ([\d.]+)', exposition)
+        self.assertGreater(float(queries.group(1)), 0)
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE bot_turn_seconds histogram", response.content)
+
+
+class WaterfallStepBudgetTest(TestCase):
+    """
+    Every waterfall step of the dialogs, run by simulated users against seeded decks, uses exactly its
+    budget of database queries and of calls to the database helpers, each a hop to a database thread.
+    Budgets count the steps of dialogs a step begins, like bot_step_db_queries at /api/metrics. A step
+    off budget fails with the SQL of its most expensive run, so an extra query fails and a saved one
+    lowers the budget; a new step fails until it gets a budget.
+    """
+
+    # step: (queries, database helper calls) of the most expensive run of the step
+    BUDGETS = {
+        'ChooseTopicDialog.give_choice_step': (2, 1),
+        'ChooseTopicDialog.confirm_choice_step': (1, 2),
+        'ChooseTopicDialog.choose_again_step': (12, 3),
+        'ChooseTopicDialog.loop': (1, 1),
+        'InitialLearningDialog.show_card_step': (4, 2),
+        'InitialLearningDialog.show_answer_step': (8, 2),
+        'InitialLearningDialog.loop_step': (12, 4),
+        'QuizDialog.show_question_step': (3, 1),
+        'QuizDialog.check_answer_step': (2, 1),
+        'CancelAndHelpDialog.show_help': (0, 0),
+        'CancelAndHelpDialog.process_interruption_choice': (2, 2),
+        'CancelAndHelpDialog.confirmation_step': (0, 0),
+        'CancelAndHelpDialog.drop_step': (9, 1),
+    }
+
+    def test_steps_stay_within_budget(self):
+        first, second = seed_content(decks=2, cards=3, questions=2)
+        learning, reviewing = journey_scripts(random.Random(2), first.title, second.title, 3, hard_percent=50)
+        dropping = ["hi", first.title, "yes", "Show answer", "drop", "yes", second.title, "yes", "?",
+                    "Drop the topic", "yes"]
+        adapter = MeteredAdapter(BotFrameworkAdapterSettings(None, None), BotMetrics())
+        adapter.on_turn_error = on_error
+        runs = {}
+        open_steps = []
+
+        def record_query(execute, sql, params, many, context):
+            for queries in open_steps:
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        on_step = MeteredWaterfallDialog.on_step
+
+        async def recording_on_step(dialog, step_context):
+            turn = TURN.get()
+            queries, db_calls = [], turn.db_calls
+            open_steps.append(queries)
+            try:
+                return await on_step(dialog, step_context)
+            finally:
+                open_steps.remove(queries)
+                runs.setdefault(dialog.get_step_name(step_context.index), []).append(
+                    (len(queries), turn.db_calls - db_calls, queries))
+
+        def say(user_id, texts):
+            for text in texts:
+                activity = message_activity(user_id, text)
+                activity.delivery_mode = DeliveryModes.expect_replies
+                async_to_sync(adapter.process_activity)(activity, "", BOT.on_turn)
+
+        with connection.execute_wrapper(record_query), \
+                mock.patch.object(MeteredWaterfallDialog, 'on_step', recording_on_step):
+            say("budget-learner", [text for _, text in learning])
+            make_cards_due("budget-learner")
+            say("budget-learner", [text for _, text in reviewing])
+            say("budget-dropper", dropping)
+
+        self.assertEqual(sorted(runs), sorted(self.BUDGETS))
+        for step, (query_budget, call_budget) in self.BUDGETS.items():
+            with self.subTest(step):
+                queries, calls, sql = max(runs[step], key=lambda run: run[:2])
+                self.assertEqual(queries, query_budget, "%d queries:\n%s" % (queries, "\n".join(sql)))
+                self.assertEqual(max(run[1] for run in runs[step]), call_budget)
+
+
+class TurnProfilerTest(TestCase):
+    def test_sampled_turns_are_kept_and_served_to_staff(self):
+        deck = seed_content(decks=1, cards=2, questions=0)[0]
+        adapter = LocalAdapter()
+        adapter.on_turn_error = on_error
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = TurnProfiler(2, directory, keep=2)
+            with mock.patch.object(BOT, 'profiler', profiler):
+                for text in learning_script(deck.title, 2)[:6]:
+                    async_to_sync(adapter.process_activity)(message_activity("profiled", text), "", BOT.on_turn)
+            captures = profiler.captures()
+            self.assertEqual(len(captures), 2)
+            self.assertGreaterEqual(captures[0]['seconds'], captures[1]['seconds'])
+            self.assertEqual(captures[0]['activity_type'], "message")
+            for capture in captures:
+                self.assertEqual(capture['dialog_stack'][:3], ["MainDialog", "ChooseTopicDialog", "InitialLearningDialog"])
+
+            name = captures[0]['name']
+            self.assertEqual(self.client.get(f'/api/profiles/{name}').status_code, 302)
+            staff = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+            self.client.force_login(staff)
+            with mock.patch('bot.views.PROFILER', profiler):
+                self.assertContains(self.client.get('/api/profiles'), f"{name}.prof")
+                # a limit that is not a number falls back to the default, one below 1 still lists a capture
+                for limit, listed in (("1", 1), ("abc", 2), ("-5", 1), ("100000", 2)):
+                    response = self.client.get('/api/profiles', {'limit': limit})
+                    self.assertEqual(len(response.context['captures']), listed, limit)
+                response = self.client.get(f'/api/profiles/{name}')
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(len(b"".join(response.streaming_content)), 0)
+            self.assertEqual(self.client.get('/api/profiles/..%2Fsecret').status_code, 404)
+
+
+async def post(app, body: bytes):
+    """
+    POSTs body to an ASGI app as JSON and returns the response status and body.
+    """
+    scope = {"type": "http", "method": "POST", "path": "/api/messages",
+             "headers": [(b"content-type", b"application/json")]}
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] = message["body"]
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+class BotMessagesAppTest(TestCase):
+    def test_malformed_activities_are_bad_requests(self):
+        app = BotMessagesApp(LocalAdapter(), BOT)
+        for body in (b"{not json", b'"text"', b'{"timestamp": "yesterday"}'):
+            self.assertEqual(async_to_sync(post)(app, body), (400, b""))
+
+    def test_ack_mode_queues_turns_and_answers_invokes_inline(self):
+        class BlockingBot:
+            # acknowledged turns wait for release, invokes and expectReplies deliveries answer at once
+            def __init__(self):
+                self.release = asyncio.Event()
+                self.started = 0
+
+            async def on_turn(self, context):
+                activity = context.activity
+                if activity.type == ActivityTypes.invoke:
+                    await context.send_activity(Activity(type=ActivityTypes.invoke_response,
+                                                         value=InvokeResponse(status=200, body={"name": activity.name})))
+                elif activity.delivery_mode == DeliveryModes.expect_replies:
+                    await context.send_activity("pong")
+                else:
+                    self.started += 1
+                    await self.release.wait()
+
+        def body(activity):
+            return json.dumps(activity.serialize()).encode()
+
+        async def converse():
+            bot = BlockingBot()
+            pool = TurnWorkerPool(workers=1, max_queue=1)
+            app = BotMessagesApp(BotFrameworkAdapter(BotFrameworkAdapterSettings(None, None)), bot, pool)
+            self.assertEqual(await post(app, body(message_activity("ack-1", "hi"))), (202, b""))
+            await asyncio.sleep(0.01)
+            # the only worker runs the first turn, the second waits in the queue and the third finds it full
+            self.assertEqual(await post(app, body(message_activity("ack-2", "hi"))), (202, b""))
+            self.assertEqual(await post(app, body(message_activity("ack-3", "hi"))), (503, b""))
+            self.assertEqual(pool.stats()['rejected'], 1)
+
+            invoke = message_activity("ack-4", None)
+            invoke.type, invoke.name = ActivityTypes.invoke, "ping"
+            status, response = await post(app, body(invoke))
+            self.assertEqual((status, json.loads(response)), (200, {"name": "ping"}))
+            replies = message_activity("ack-5", "ping")
+            replies.delivery_mode = DeliveryModes.expect_replies
+            status, response = await post(app, body(replies))
+            self.assertEqual(status, 200)
+            self.assertEqual([activity["text"] for activity in json.loads(response)["activities"]], ["pong"])
+
+            bot.release.set()
+            await pool.drain()
+            self.assertEqual((bot.started, pool.stats()['processed']), (2, 2))
+
+        async_to_sync(converse)()
+
+    def test_ack_mode_authenticates_before_accepting(self):
+        pool = TurnWorkerPool(workers=1, max_queue=1)
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("app-id", "app-password"))
+        app = BotMessagesApp(adapter, BOT, pool)
+        body = json.dumps(message_activity("ack-auth", "hi").serialize()).encode()
+        self.assertEqual(async_to_sync(post)(app, body), (401, b""))
+        self.assertEqual((pool.queued, pool.running, pool.processed), (0, 0, 0))
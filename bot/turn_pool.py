@@ -0,0 +1,89 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Set
+
+from bot.dispatcher import ConversationDispatcher
+
+logger = getLogger(__name__)
+
+
+class TurnWorkerPool:
+    """
+    Runs turns in the background once the webhook request has been acknowledged. At most `workers` turns
+    run at the same time and at most `max_queue` accepted turns wait for a worker; anything beyond that
+    is rejected so the channel retries the delivery later.
+    Turns of one conversation are started in submission order and a turn waiting for its predecessor
+    does not occupy a worker.
+    """
+
+    def __init__(self, workers: int, max_queue: int, dispatcher: ConversationDispatcher = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.dispatcher = dispatcher or ConversationDispatcher()
+        self.queued = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._slots = None
+        self._tasks: Set[asyncio.Future] = set()
+
+    def submit(self, turn: Callable[[], Awaitable], conversation_id: str = None) -> bool:
+        """
+        Queues the turn and returns immediately. Returns False if the queue is full.
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            logger.warning('turn queue is full (%d waiting, %d running), rejected %d turns so far',
+                           self.queued, self.running, self.rejected)
+            return False
+        if self._slots is None:
+            # created on first use so that it belongs to the server's event loop
+            self._slots = asyncio.Semaphore(self.workers)
+        self.queued += 1
+        enqueued_at = time.monotonic()
+        task = asyncio.ensure_future(self.dispatcher.run(conversation_id, lambda: self._run(turn, enqueued_at)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, turn: Callable[[], Awaitable], enqueued_at: float):
+        async with self._slots:
+            self.queued -= 1
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.running += 1
+            try:
+                await turn()
+            except Exception:
+                self.failed += 1
+                logger.exception('background turn failed')
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    async def drain(self):
+        """
+        Waits for every accepted turn to finish, used on server shutdown.
+        """
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def stats(self) -> dict:
+        started = self.processed + self.running
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'queued': self.queued,
+            'running': self.running,
+            'active_conversations': self.dispatcher.active_conversations,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_wait_seconds': self.total_wait / started if started else 0.0,
+            'max_wait_seconds': self.max_wait,
+        }
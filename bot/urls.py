@@ -5,4 +5,10 @@ from . import views
 urlpatterns = [
     path('messages', views.index, name='index'),
     path('notify', views.notify, name='notify'),
+    path('turns', views.turn_pool, name='turn_pool'),
+    path('content', views.content_cache, name='content_cache'),
+    path('db', views.db_executor, name='db_executor'),
+    path('metrics', views.metrics, name='metrics'),
+    path('profiles', views.turn_profiles, name='turn_profiles'),
+    path('profiles/<str:name>', views.turn_profile, name='turn_profile'),
 ]
\ No newline at end of file
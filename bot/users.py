@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from logging import getLogger
+from typing import Dict
+
+from django.db.models.signals import post_delete
+
+from bot.db import db_call
+from bot.models import User
+
+logger = getLogger(__name__)
+
+
+class UserActivity:
+    """
+    Keeps track of users the bot talks to without a database round trip per turn. Users this process has
+    already seen are remembered, so only a new user costs a query. Interaction times are buffered and
+    written with one bulk UPDATE once `flush_seconds` have passed since the last flush, and on shutdown;
+    until then User.last_interaction_time can lag behind by that much.
+    """
+
+    def __init__(self, flush_seconds: float = 60, max_known: int = 100000):
+        self.flush_seconds = flush_seconds
+        self.max_known = max_known
+        # user id -> None, in least recently seen order
+        self._known: OrderedDict = OrderedDict()
+        self._pending: Dict[str, datetime] = {}
+        self._last_flush = time.monotonic()
+        self.flushes = 0
+        self.flushed_users = 0
+        # a user deleted in the admin is created again on their next message
+        post_delete.connect(self._user_deleted, sender=User)
+
+    async def touch(self, user_id: str):
+        """
+        Makes sure the user exists and records the interaction.
+        """
+        if user_id in self._known:
+            self._known.move_to_end(user_id)
+        else:
+            await self._get_or_create(user_id)
+            self._known[user_id] = None
+            if len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+        self._pending[user_id] = datetime.now().astimezone()
+
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes the buffered interaction times.
+        """
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self._update(pending)
+        except Exception:
+            # keep the times for the next flush unless newer ones were recorded meanwhile
+            self._pending = {**pending, **self._pending}
+            raise
+        self.flushes += 1
+        self.flushed_users += len(pending)
+        logger.info('flushed last interaction time of %d users', len(pending))
+
+    def _user_deleted(self, sender, instance: User, **kwargs):
+        self._known.pop(instance.user_id, None)
+        self._pending.pop(instance.user_id, None)
+
+    @db_call
+    def _get_or_create(self, user_id: str):
+        User.objects.get_or_create(user_id=user_id)
+
+    @db_call
+    def _update(self, pending: Dict[str, datetime]):
+        # bulk_update writes the given values, auto_now does not apply
+        User.objects.bulk_update(
+            [User(user_id=user_id, last_interaction_time=seen) for user_id, seen in pending.items()],
+            ['last_interaction_time'])
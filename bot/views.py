@@ -1,12 +1,20 @@
 # Create your views here.
-from botbuilder.core import TurnContext
 from botbuilder.schema import Activity
-from django.http import HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.shortcuts import render
 
-from bot.bot import ADAPTER, BOT, CONVERSATION_REFERENCES, DefaultConfig
+from bot.bot import ADAPTER, BOT, PROFILER, REMINDERS, TURN_POOL
+from bot.content import CONTENT
+from bot.db import DB
+from bot.metrics import METRICS
 from asgiref.sync import async_to_sync
 import json
 
+# captures listed on the turn profiles page, unless ?limit= asks for another number up to the maximum
+TURN_PROFILES_LIMIT = 50
+TURN_PROFILES_MAX_LIMIT = 500
+
 
 def index(request):
     """
@@ -30,23 +38,66 @@ def index(request):
 async def get_bot_response(activity, auth_header):
     return await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
 
+def turn_pool(request):
+    """
+    Queue depth, wait time and rejections of the background turn workers (ACK_MODE only).
+    """
+    return JsonResponse(TURN_POOL.stats())
+
+
+def content_cache(request):
+    """
+    Size, hits, misses and evictions of the process-wide content cache.
+    """
+    return JsonResponse(CONTENT.stats())
+
+
+def metrics(request):
+    """
+    Turn, waterfall step, database and state storage latency histograms in the Prometheus text format.
+    """
+    return HttpResponse(METRICS.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def db_executor(request):
+    """
+    Queue depth and wait time of the threads that run the dialogs' database queries.
+    """
+    return JsonResponse(DB.stats())
+
+
 @async_to_sync
 async def notify(request):
-    await _send_proactive_message()
-    return HttpResponse(status=200)
+    """
+    Reminds every user with due cards to review them, and returns the number of sent messages and the throughput.
+    While a run is in progress, answers 409 with its progress so far.
+    """
+    stats = await REMINDERS.run()
+    return JsonResponse(stats, status=409 if stats.get('already_running') else 200)
 
 
-# Send a message to all conversation members.
-# This uses the shared Dictionary that the Bot adds conversation references to.
-async def _send_proactive_message():
-    for conversation_reference in CONVERSATION_REFERENCES.values():
-        user_id = conversation_reference.user.id
-        await ADAPTER.continue_conversation(
-            conversation_reference,
-            lambda turn_context: notify_user(user_id, turn_context),
-            DefaultConfig.APP_ID
-        )
+@staff_member_required
+def turn_profiles(request):
+    """
+    The slowest of the sampled turn profiles, for staff only.
+    """
+    try:
+        limit = int(request.GET.get("limit", TURN_PROFILES_LIMIT))
+    except ValueError:
+        limit = TURN_PROFILES_LIMIT
+    return render(request, "admin/turn_profiles.html", {
+        "title": "Turn profiles",
+        "profiler": PROFILER,
+        "captures": PROFILER.captures()[:max(1, min(limit, TURN_PROFILES_MAX_LIMIT))],
+    })
 
 
-async def notify_user(user_id, turn_context: TurnContext):
-    return await turn_context.send_activity(f"proactive hello user {user_id}")
+@staff_member_required
+def turn_profile(request, name):
+    """
+    Downloads one turn profile, to open with pstats or snakeviz.
+    """
+    path = PROFILER.path(name)
+    if path is None:
+        raise Http404("No such turn profile")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{name}.prof")
@@ -16,4 +16,12 @@ if os.environ.get('DJANGO_ENV') == 'production':
 else:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sashick_bot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Bot routes are imported after Django is set up because the dialogs use the ORM.
+from bot.asgi import BotMessagesApp, BotRouter
+from bot.bot import ADAPTER, BOT, CONFIG, DISPATCHER, TURN_POOL, USER_ACTIVITY
+
+application = BotRouter(django_application, {
+    '/api/messages': BotMessagesApp(ADAPTER, BOT, TURN_POOL if CONFIG.ACK_MODE else None, DISPATCHER),
+}, on_shutdown=[TURN_POOL.drain, USER_ACTIVITY.flush])
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 from dotenv import load_dotenv
 load_dotenv(verbose=True)
@@ -87,6 +88,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # seconds a connection is reused, by requests and by the threads of bot.db.DatabaseExecutor
+        'CONN_MAX_AGE': int(os.getenv("CONN_MAX_AGE", "60")),
+        # a file rather than memory, so tests that use several connections get SQLite's real locking
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'sashick_bot_test.sqlite3')},
     }
 }
 